@@ -0,0 +1,37 @@
+import sys
+import logging
+import argparse
+from app.utils.candidates import DEFAULT_CANDIDATES_K, precompute_candidates_file
+
+# --- Logger Configuration ---
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+logger = logging.getLogger(__name__)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Precompute BM25 candidates for every point of an annotation file."
+    )
+    parser.add_argument("data_file", help="Annotation JSON file")
+    parser.add_argument(
+        "-k",
+        type=int,
+        default=DEFAULT_CANDIDATES_K,
+        help=f"Candidates stored per point (default: {DEFAULT_CANDIDATES_K})",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: all cores)",
+    )
+    args = parser.parse_args()
+
+    path = precompute_candidates_file(args.data_file, args.k, args.processes)
+    logger.info(f"Candidates written to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,1200 @@
 import os
-import pickle
+import re
+import json
+import mmap
+import shutil
+import time
+import hashlib
 import logging
-from rank_bm25 import BM25Okapi
-import spacy
-from typing import Any
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from typing import Any, Callable, Iterable, NamedTuple, Sequence
+from app.utils.bm25_index import (
+    BM25Index,
+    BM25Segment,
+    Near,
+    Phrase,
+    Vocabulary,
+    merge_segments,
+)
+from app.utils.index_cache import IndexCache
+from app.utils.near_duplicates import minhash_texts
+from app.utils.processes import process_pool
+from app.utils.tokenizers import DEFAULT_TOKENIZER, get_tokenizer, tokenizer_for
 
 logger = logging.getLogger(__name__)
-nlp = spacy.load("de_core_news_sm")
+
+# Bump whenever the on-disk index layout or the scoring parameters change
+INDEX_FORMAT_VERSION = 4
+INDEX_PARAMS_FILE = "index.json"
+DELETED_FILE = "deleted.npy"
+CLUSTERS_FILE = "clusters.npy"
+# Sharded copy of a cached index: one index per shard plus the statistics
+# shared by all shards and the index positions of every shard's documents
+SHARDS_DIR = "shards"
+SHARDS_FILE = "shards.json"
+STATISTICS_FILE = "statistics.npz"
+DOC_POSITIONS_FILE = "doc_positions.npy"
+# Live documents per shard below which an index is not sharded
+SHARD_MIN_DOCS = 250_000
+
+# Delta segments are merged into the base segment once they hold this share of
+# the documents, tombstones are purged once this share of documents is deleted
+MERGE_DELTA_RATIO = 0.1
+MERGE_DELETED_RATIO = 0.2
+
+# Texts per process pool task during index builds
+TOKENIZE_CHUNK_SIZE = 5000
+
+# Called with (stage, done, total) while an index is built, loaded or saved
+ProgressCallback = Callable[[str, int, int], None]
+
+# Query syntax: "quoted phrases", NEAR/k between two words or phrases, plain words
+QUERY_PATTERN = re.compile(r'"([^"]*)"?|\bNEAR(?:/(\d+))?\b|(\S+)')
+NEAR_DEFAULT_DISTANCE = 10
+# Indexed terms a partially typed last word expands to in search-as-you-type
+PREFIX_EXPANSIONS = 16
+# Relevance feedback: number of expansion terms taken from the relevant texts
+# and the weight of the heaviest one, relative to a term of the typed query
+FEEDBACK_TERMS = 20
+FEEDBACK_WEIGHT = 0.5
+# Reciprocal-rank fusion: matches fused from every ranking and the damping
+# constant of Cormack et al. (2009)
+FUSION_DEPTH = 1000
+RRF_K = 60
+
+
+class ParsedQuery(NamedTuple):
+    """Normalized query: the tokens to score plus phrase and proximity constraints."""
+
+    tokens: tuple[str, ...]
+    constraints: tuple[Phrase | Near, ...] = ()
+
+
+def parse_query(query: str, tokenizer: str = DEFAULT_TOKENIZER) -> ParsedQuery:
+    """
+    Parses a search bar query. Quoted phrases must occur verbatim and
+    ``a NEAR/k b`` requires ``a`` and ``b`` (words or quoted phrases) within
+    ``k`` tokens of each other; ``NEAR`` alone allows NEAR_DEFAULT_DISTANCE.
+    All words are also scored with BM25 as usual.
+    """
+    if '"' not in query and "NEAR" not in query:
+        return ParsedQuery(tuple(tokenize(query, tokenizer)))
+
+    # Items are (tokens, quoted) for words and phrases, or a NEAR distance
+    items: list[tuple[tuple[str, ...], bool] | int] = []
+    for match in QUERY_PATTERN.finditer(query):
+        phrase, distance, word = match.groups()
+        if word is not None or phrase is not None:
+            tokens = tuple(tokenize(word if phrase is None else phrase, tokenizer))
+            if tokens:
+                items.append((tokens, phrase is not None))
+        elif match.group(0):
+            items.append(int(distance) if distance else NEAR_DEFAULT_DISTANCE)
+
+    constraints: list[Phrase | Near] = []
+    operands = set()
+    for position, item in enumerate(items):
+        if not isinstance(item, int):
+            continue
+        if 0 < position < len(items) - 1:
+            left, right = items[position - 1], items[position + 1]
+            if not isinstance(left, int) and not isinstance(right, int):
+                constraints.append(Near(left[0], right[0], item))
+                operands.update((position - 1, position + 1))
+    for position, item in enumerate(items):
+        if not isinstance(item, int) and item[1] and len(item[0]) > 1:
+            if position not in operands:
+                constraints.append(Phrase(item[0]))
+
+    tokens = tuple(
+        token for item in items if not isinstance(item, int) for token in item[0]
+    )
+    return ParsedQuery(tokens, tuple(constraints))
+
+
+class SearchResult(NamedTuple):
+    """A ranked document: its position in the index, its corpus ID and its score."""
+
+    doc_index: int
+    doc_id: int
+    score: float
+
+
+class RankedResults:
+    """
+    All matches of a query, ranked lazily page by page.
+
+    Only the first ``sorted_count`` matches are in their final order. Fetching
+    a page beyond them partially sorts just as many of the remaining matches
+    as needed (argpartition plus a sort of the selected ones), so paging
+    through the results never scores the query again. Ties are ranked by
+    document position, like ``BM25Index.top_k``. A collapsed ranking (see
+    ``collapse``) also keeps the near-duplicates of its matches, given as
+    ``duplicates`` (match -> ranked doc indices and scores of the others).
+    """
+
+    def __init__(
+        self,
+        doc_indices: np.ndarray,
+        scores: np.ndarray,
+        doc_ids: np.ndarray,
+        duplicates: dict[int, tuple[np.ndarray, np.ndarray]] | None = None,
+    ) -> None:
+        self.doc_indices = np.array(doc_indices, dtype=np.int64)
+        self.scores = np.array(scores, dtype=np.float64)
+        self.doc_ids = doc_ids
+        self.sorted_count = 0
+        # Ranked other matches (doc indices, scores) of collapsed clusters
+        self._duplicates = dict(duplicates or {})
+
+    def __len__(self) -> int:
+        return len(self.doc_indices)
+
+    def _sort_prefix(self, count: int) -> None:
+        start = self.sorted_count
+        count = min(count, len(self)) - start
+        if count <= 0:
+            return
+        docs, scores = self.doc_indices[start:], self.scores[start:]
+        if count < len(docs):
+            selected = np.argpartition(-scores, count - 1)[:count]
+            rest = np.setdiff1d(np.arange(len(docs)), selected, assume_unique=True)
+        else:
+            selected, rest = np.arange(len(docs)), np.zeros(0, dtype=np.int64)
+        selected = selected[np.lexsort((docs[selected], -scores[selected]))]
+        order = np.concatenate((selected, rest))
+        self.doc_indices[start:], self.scores[start:] = docs[order], scores[order]
+        self.sorted_count = start + count
+
+    def _results(
+        self, doc_indices: np.ndarray, scores: np.ndarray
+    ) -> list[SearchResult]:
+        return [
+            SearchResult(doc_index, doc_id, score)
+            for doc_index, doc_id, score in zip(
+                doc_indices.tolist(), self.doc_ids[doc_indices].tolist(), scores.tolist()
+            )
+        ]
+
+    def top(self, count: int) -> np.ndarray:
+        """Returns the doc indices of the first ``count`` matches, best first."""
+        self._sort_prefix(count)
+        return self.doc_indices[:count]
+
+    def page(self, start: int, count: int) -> list[SearchResult]:
+        """Returns the ranked matches ``start`` to ``start + count``."""
+        self._sort_prefix(start + count)
+        return self._results(
+            self.doc_indices[start : start + count], self.scores[start : start + count]
+        )
+
+    def collapse(self, clusters: np.ndarray) -> "RankedResults":
+        """
+        Returns a ranking with only the best match of every near-duplicate
+        cluster (``clusters`` maps document positions to cluster ids). The
+        other matches of a cluster are available through ``duplicates``.
+        """
+        cluster_ids = np.asarray(clusters)[self.doc_indices]
+        order = np.lexsort((self.doc_indices, -self.scores, cluster_ids))
+        sorted_ids = cluster_ids[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_ids[1:] != sorted_ids[:-1]
+        representatives = order[first]
+        starts = np.flatnonzero(first)
+        sizes = np.diff(np.append(starts, len(order)))
+        duplicates = {}
+        for start, size in zip(starts[sizes > 1].tolist(), sizes[sizes > 1].tolist()):
+            members = order[start : start + size]
+            duplicates[int(self.doc_indices[members[0]])] = (
+                self.doc_indices[members[1:]],
+                self.scores[members[1:]],
+            )
+        return RankedResults(
+            self.doc_indices[representatives],
+            self.scores[representatives],
+            self.doc_ids,
+            duplicates,
+        )
+
+    def num_duplicates(self, doc_index: int) -> int:
+        """Returns the number of collapsed near-duplicates of a match."""
+        duplicates = self._duplicates.get(doc_index)
+        return 0 if duplicates is None else len(duplicates[0])
+
+    def duplicates(self, doc_index: int) -> list[SearchResult]:
+        """Returns the collapsed near-duplicates of a match, best first."""
+        duplicates = self._duplicates.get(doc_index)
+        return [] if duplicates is None else self._results(*duplicates)
+
+    def duplicate_groups(
+        self, doc_indices: np.ndarray
+    ) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+        """Returns the collapsed near-duplicates (doc indices, scores) of the given matches."""
+        grouped = np.fromiter(self._duplicates, dtype=np.int64, count=len(self._duplicates))
+        return {
+            doc_index: self._duplicates[doc_index]
+            for doc_index in grouped[np.isin(grouped, doc_indices)].tolist()
+        }
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[RankedResults],
+    clusters: np.ndarray | None = None,
+    depth: int = FUSION_DEPTH,
+    k: int = RRF_K,
+) -> RankedResults:
+    """
+    Fuses rankings of the same index by reciprocal rank: every match scores
+    the sum of ``1 / (k + rank)`` over the first ``depth`` matches of all
+    rankings. The first ranking is the primary one: its matches beyond
+    ``depth`` that no ranking placed higher follow the fused matches in their
+    own order, so no match of it is lost. With ``clusters``, collapsed
+    rankings are fused per near-duplicate cluster, represented by its match
+    in the first ranking that has one, along with the collapsed duplicates of
+    that match.
+    """
+    keys, docs, scores = [], [], []
+    for ranking in rankings:
+        ranked = ranking.top(depth)
+        docs.append(ranked)
+        keys.append(ranked if clusters is None else np.asarray(clusters)[ranked])
+        scores.append(1.0 / (k + np.arange(1, len(ranked) + 1)))
+    keys_array = np.concatenate(keys)
+    # The first occurrence of a key comes from the earliest ranking matching it
+    unique_keys, first, inverse = np.unique(
+        keys_array, return_index=True, return_inverse=True
+    )
+    representatives = np.concatenate(docs)[first]
+    fused_scores = np.bincount(
+        inverse, weights=np.concatenate(scores), minlength=len(unique_keys)
+    )
+
+    # Every fused match scores at least 1 / (k + depth), the tail is mapped
+    # monotonically below that
+    primary = rankings[0]
+    tail = primary.doc_indices[depth:]
+    tail_keys = tail if clusters is None else np.asarray(clusters)[tail]
+    kept = ~np.isin(tail_keys, unique_keys)
+    tail, tail_scores = tail[kept], primary.scores[depth:][kept]
+    if len(tail):
+        scale = float(np.abs(tail_scores).max()) or 1.0
+        tail_scores = (1 + tail_scores / scale) / 2 / (k + depth + 1)
+
+    duplicates = {}
+    for ranking in reversed(rankings):
+        duplicates.update(ranking.duplicate_groups(representatives))
+    duplicates.update(primary.duplicate_groups(tail))
+    return RankedResults(
+        np.concatenate((representatives, tail)),
+        np.concatenate((fused_scores, tail_scores)),
+        primary.doc_ids,
+        duplicates,
+    )
+
+
+class BM25Searcher:
+    """
+    Query layer on top of a ``BM25Index``.
+
+    Queries are normalized with the tokenizer the index was built with,
+    and ranked results are memoised per (normalized query, k, exclusions) in a
+    bounded LRU cache. The full rankings used for paging are kept in a smaller
+    one, as they hold every match of a query. Swapping the index through
+    ``set_index`` drops both caches. A searcher must only be used from one
+    thread at a time.
+    """
+
+    def __init__(
+        self, index: BM25Index, cache_size: int = 256, ranking_cache_size: int = 4
+    ) -> None:
+        self.index = index
+        self.cache_size = cache_size
+        self.ranking_cache_size = ranking_cache_size
+        self._cache: OrderedDict[tuple, tuple[np.ndarray, np.ndarray]] = OrderedDict()
+        self._rankings: OrderedDict[tuple, RankedResults] = OrderedDict()
+
+    def set_index(self, index: BM25Index) -> None:
+        """Replaces the searched index and invalidates all cached results."""
+        self.index = index
+        self._cache.clear()
+        self._rankings.clear()
+
+    def normalize_query(self, query: str, prefix: bool = False) -> ParsedQuery:
+        """
+        Parses a raw query string, tokenizing it exactly like indexed documents.
+        With ``prefix``, a last word that is still being typed (no trailing space
+        or quote) is replaced by the indexed terms it is a prefix of.
+        """
+        parsed = parse_query(query, self.index.tokenizer)
+        if not prefix or not parsed.tokens or not query[-1:].isalnum():
+            return parsed
+        partial = parsed.tokens[-1]
+        expansions = self.index.expand_prefix(partial, PREFIX_EXPANSIONS)
+        return parsed._replace(tokens=parsed.tokens[:-1] + tuple(expansions or [partial]))
+
+    def _exclusion(
+        self, parsed: ParsedQuery, excluded: frozenset[int]
+    ) -> np.ndarray:
+        """
+        Returns the excluded document indices, or, for queries with phrase or
+        proximity constraints, a mask also excluding all documents violating them.
+        """
+        exclude = np.fromiter(excluded, dtype=np.int64, count=len(excluded))
+        if not parsed.constraints:
+            return exclude
+        if not self.index.has_positions:
+            logger.warning("Index has no token positions, ignoring phrase constraints")
+            return exclude
+        mask = np.ones(self.index.corpus_size, dtype=bool)
+        mask[self.index.positional_matches(parsed.constraints)] = False
+        mask[exclude] = True
+        return mask
+
+    def _top_k(
+        self,
+        query_tokens: Sequence[str] | dict[str, float],
+        k: int,
+        exclusion: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Scores a query for ``search``, see ``BM25Index.top_k``."""
+        return self.index.top_k(query_tokens, k, exclusion)
+
+    def _matches(
+        self, query_tokens: Sequence[str] | dict[str, float], exclusion: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Scores a query for ``rank``, see ``BM25Index.matches``."""
+        return self.index.matches(query_tokens, exclusion)
+
+    def search(
+        self, query: str, k: int, exclude: Iterable[int] = ()
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the document indices and scores of the ``k`` best matches for
+        ``query``, leaving out the document indices in ``exclude``.
+        The returned arrays are shared with the cache and must not be modified.
+        """
+        excluded = frozenset(exclude)
+        key = (self.normalize_query(query), k, excluded)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+
+        ranked, scores = self._top_k(
+            key[0].tokens, k, self._exclusion(key[0], excluded)
+        )
+        ranked.setflags(write=False)
+        scores.setflags(write=False)
+
+        self._cache[key] = (ranked, scores)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return ranked, scores
+
+    def rank(
+        self,
+        query: str,
+        exclude: Iterable[int] = (),
+        prefix: bool = False,
+        collapse: bool = False,
+    ) -> RankedResults:
+        """
+        Scores ``query`` once and returns all its matches for paging, leaving
+        out the document indices in ``exclude``. ``prefix`` expands a partially
+        typed last word (see ``normalize_query``), ``collapse`` keeps only the
+        best match of every near-duplicate cluster if the index has clusters.
+        """
+        parsed = self.normalize_query(query, prefix)
+        return self._ranking(parsed, parsed.tokens, frozenset(exclude), collapse)
+
+    def _ranking(
+        self,
+        parsed: ParsedQuery,
+        query_tokens: Sequence[str] | dict[str, float],
+        excluded: frozenset[int],
+        collapse: bool,
+    ) -> RankedResults:
+        """Returns the cached ranking of a query or scores and caches it."""
+        collapse = collapse and self.index.clusters is not None
+        weights = None
+        if isinstance(query_tokens, dict):
+            weights = tuple(sorted(query_tokens.items()))
+        key = (parsed, weights, excluded, collapse)
+        ranking = self._rankings.get(key)
+        if ranking is not None:
+            self._rankings.move_to_end(key)
+            return ranking
+
+        doc_indices, scores = self._matches(
+            query_tokens, self._exclusion(parsed, excluded)
+        )
+        ranking = RankedResults(doc_indices, scores, self.index.doc_ids)
+        if collapse:
+            ranking = ranking.collapse(self.index.clusters)
+        self._rankings[key] = ranking
+        if len(self._rankings) > self.ranking_cache_size:
+            self._rankings.popitem(last=False)
+        return ranking
+
+    def feedback_query(
+        self,
+        relevant: Iterable[int],
+        query: str = "",
+        num_terms: int = FEEDBACK_TERMS,
+        feedback_weight: float = FEEDBACK_WEIGHT,
+    ) -> dict[str, float]:
+        """
+        Builds a weighted Rocchio query from the ``relevant`` document indices:
+        the terms of ``query`` (weight 1 per occurrence) plus the ``num_terms``
+        terms with the highest mean BM25 impact over the relevant documents,
+        scaled so the heaviest one weighs ``feedback_weight``.
+        """
+        weights: dict[str, float] = {}
+        for token in self.normalize_query(query).tokens:
+            weights[token] = weights.get(token, 0.0) + 1.0
+        feedback = self.index.feedback_terms(sorted(set(relevant)), num_terms)
+        if feedback:
+            scale = feedback_weight / max(feedback.values())
+            for term, weight in feedback.items():
+                weights[term] = weights.get(term, 0.0) + weight * scale
+        return weights
+
+    def rank_weighted(
+        self,
+        weights: dict[str, float],
+        exclude: Iterable[int] = (),
+        collapse: bool = False,
+    ) -> RankedResults:
+        """Like ``rank``, for a query of weighted terms (see ``feedback_query``)."""
+        return self._ranking(ParsedQuery(()), weights, frozenset(exclude), collapse)
+
+    def search_results(
+        self, query: str, k: int, exclude: Iterable[int] = ()
+    ) -> list[SearchResult]:
+        """Like ``search``, but pairs every match with its document ID."""
+        ranked, scores = self.search(query, k, exclude)
+        doc_ids = self.index.doc_ids[ranked]
+        return [
+            SearchResult(doc_index, doc_id, score)
+            for doc_index, doc_id, score in zip(
+                ranked.tolist(), doc_ids.tolist(), scores.tolist()
+            )
+        ]
+
+
+# Shard indexes opened by a ShardedSearcher worker process, by path
+_worker_shards: dict[str, BM25Index] = {}
+
+
+def _score_shard(
+    path: str,
+    query_tokens: Sequence[str] | dict[str, float],
+    k: int | None,
+    exclusion: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Scores a query on one shard: its top ``k`` or, if ``k`` is None, all matches."""
+    shard = _worker_shards.get(path)
+    if shard is None:
+        shard = _worker_shards[path] = load_index(path)
+    if k is None:
+        return shard.matches(query_tokens, exclusion)
+    return shard.top_k(query_tokens, k, exclusion)
+
+
+class ShardedSearcher(BM25Searcher):
+    """
+    ``BM25Searcher`` that scores queries on the shards of its index (see
+    ``save_sharded_index``), one task per shard in a pool of worker processes.
+
+    The whole index, memory-mapped, still parses queries, checks phrase
+    constraints and maps results to document IDs; only scoring is fanned out.
+    Shards score with the statistics of the whole index and hold contiguous
+    ranges of its documents, so the merged results are the same as those of a
+    plain searcher (``search`` ranks equal scores by position, where
+    ``BM25Index.top_k`` leaves their order open). Searchers may share one
+    ``executor``;
+    the one that created it shuts it down in ``close``.
+    """
+
+    def __init__(
+        self,
+        index: BM25Index,
+        cache_size: int = 256,
+        ranking_cache_size: int = 4,
+        executor: ProcessPoolExecutor | None = None,
+    ) -> None:
+        super().__init__(index, cache_size, ranking_cache_size)
+        self._open_shards(index)
+        self._owns_executor = executor is None
+        self.executor = executor or process_pool(len(self.shard_paths))
+
+    def _open_shards(self, index: BM25Index) -> None:
+        if index.shards_path is None:
+            raise ValueError("Index has no shards")
+        with open(
+            os.path.join(index.shards_path, SHARDS_FILE), "r", encoding="utf-8"
+        ) as f:
+            names = json.load(f)["shards"]
+        self.shard_paths = [os.path.join(index.shards_path, name) for name in names]
+        self.shard_positions = [
+            np.load(os.path.join(path, DOC_POSITIONS_FILE), mmap_mode="r")
+            for path in self.shard_paths
+        ]
+
+    def set_index(self, index: BM25Index) -> None:
+        """Replaces the searched index and its shards and invalidates all caches."""
+        self._open_shards(index)
+        super().set_index(index)
+
+    def close(self) -> None:
+        """Stops the worker processes, unless the executor is shared."""
+        if self._owns_executor:
+            self.executor.shutdown(cancel_futures=True)
+
+    def _shard_exclusion(self, positions: np.ndarray, exclusion: np.ndarray) -> np.ndarray:
+        """Translates excluded index positions (or a mask) to a shard's positions."""
+        if exclusion.dtype == bool:
+            return exclusion[positions]
+        # Exclusions are sorted, so those past the shard's end come last
+        local = np.searchsorted(positions, exclusion)
+        local = local[local < len(positions)]
+        return local[positions[local] == exclusion[: len(local)]]
+
+    def _fan_out(
+        self,
+        query_tokens: Sequence[str] | dict[str, float],
+        k: int | None,
+        exclusion: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Scores a query on all shards and maps the results to index positions."""
+        exclusion = np.asarray(exclusion)
+        if exclusion.dtype != bool:
+            exclusion = np.unique(exclusion.astype(np.int64))
+        futures = [
+            self.executor.submit(
+                _score_shard,
+                path,
+                query_tokens,
+                k,
+                self._shard_exclusion(positions, exclusion),
+            )
+            for path, positions in zip(self.shard_paths, self.shard_positions)
+        ]
+        doc_indices, scores = [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+        for future, positions in zip(futures, self.shard_positions):
+            shard_indices, shard_scores = future.result()
+            doc_indices.append(np.asarray(positions[shard_indices], dtype=np.int64))
+            scores.append(shard_scores)
+        # Shards follow each other in index order, so positions stay ascending
+        return np.concatenate(doc_indices), np.concatenate(scores)
+
+    def _top_k(
+        self,
+        query_tokens: Sequence[str] | dict[str, float],
+        k: int,
+        exclusion: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        doc_indices, scores = self._fan_out(query_tokens, k, exclusion)
+        # Every shard's top k by score, ties by position, as in BM25Index.top_k
+        order = np.lexsort((doc_indices, -scores))[:k]
+        return doc_indices[order], scores[order].astype(np.float32)
+
+    def _matches(
+        self, query_tokens: Sequence[str] | dict[str, float], exclusion: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        return self._fan_out(query_tokens, None, exclusion)
+
 
 def extract_texts_from_ground_truth(ground_truth: dict[str, Any]) -> list[str]:
     return [item["text"] for item in ground_truth.get("all_texts", [])]
 
-def tokenize(text: str) -> list[str]:
-    return [token.text.lower() for token in nlp(text) if not token.is_space]
 
-def build_bm25_index(texts: list[str]) -> BM25Okapi:
+def extract_fields_from_ground_truth(
+    ground_truth: dict[str, Any], fields: Iterable[str]
+) -> list[list[str]]:
+    """Returns, per metadata field, its value of every text ("" if missing)."""
+    return [
+        [
+            str(item.get("metadata", {}).get(field) or "")
+            for item in ground_truth.get("all_texts", [])
+        ]
+        for field in fields
+    ]
+
+
+def fields_for(ground_truth: dict[str, Any]) -> tuple[dict[str, float], float]:
+    """
+    Reads the indexed metadata fields and their boosts from the optional
+    ``bm25_fields`` mapping of an input file, e.g. ``{"description": 2.0}``.
+    A ``text`` entry sets the boost of the text itself (default 1).
+    """
+    fields = dict(ground_truth.get("bm25_fields") or {})
+    text_boost = float(fields.pop("text", 1.0))
+    return {name: float(boost) for name, boost in fields.items()}, text_boost
+
+
+def extract_ids_from_ground_truth(ground_truth: dict[str, Any]) -> np.ndarray:
+    return np.fromiter(
+        (item["id"] for item in ground_truth.get("all_texts", [])), dtype=np.int64
+    )
+
+
+def hash_document(text: str) -> int:
+    """Returns a 64-bit content hash used to detect changed documents."""
+    return int.from_bytes(
+        hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def hash_documents(
+    texts: Sequence[str], field_texts: Sequence[Sequence[str]] = ()
+) -> np.ndarray:
+    """Hashes every document, including the values of its indexed fields."""
+    if field_texts:
+        # Unit separators keep field boundaries apart
+        texts = ["\x1f".join(values) for values in zip(texts, *field_texts)]
+    return np.fromiter((hash_document(t) for t in texts), dtype=np.uint64, count=len(texts))
+
+
+def corpus_fingerprint(doc_ids: np.ndarray, doc_hashes: np.ndarray) -> str:
+    """Hashes the (id, content) pairs of a corpus in order."""
+    digest = hashlib.sha256()
+    digest.update(doc_ids.astype("<i8").tobytes())
+    digest.update(doc_hashes.astype("<u8").tobytes())
+    return digest.hexdigest()
+
+
+def tokenize(text: str, tokenizer: str = DEFAULT_TOKENIZER) -> list[str]:
+    return get_tokenizer(tokenizer).tokenize(text)
+
+
+def _tokenize_batch(tokenizer: str, texts: Sequence[str]) -> list[list[str]]:
+    return get_tokenizer(tokenizer).tokenize_batch(texts)
+
+
+def tokenize_texts(
+    texts: Sequence[str],
+    tokenizer: str = DEFAULT_TOKENIZER,
+    n_process: int | None = None,
+    progress: ProgressCallback | None = None,
+) -> list[list[str]]:
+    """
+    Tokenizes many texts for indexing, in batches and spread over a process pool
+    (all cores by default). Logs the achieved throughput and reports the number
+    of tokenized texts to ``progress`` after every batch.
+    """
+    start = time.perf_counter()
+    n_process = n_process or os.cpu_count() or 1
+    n_process = max(1, min(n_process, -(-len(texts) // TOKENIZE_CHUNK_SIZE)))
+    chunks = [
+        texts[i : i + TOKENIZE_CHUNK_SIZE]
+        for i in range(0, len(texts), TOKENIZE_CHUNK_SIZE)
+    ]
+    tokenized: list[list[str]] = []
+    if progress:
+        progress("Tokenizing texts", 0, len(texts))
+    if n_process == 1:
+        for chunk in chunks:
+            tokenized.extend(_tokenize_batch(tokenizer, chunk))
+            if progress:
+                progress("Tokenizing texts", len(tokenized), len(texts))
+    else:
+        executor = process_pool(n_process)
+        try:
+            futures = [
+                executor.submit(_tokenize_batch, tokenizer, chunk) for chunk in chunks
+            ]
+            for future in futures:
+                tokenized.extend(future.result())
+                if progress:
+                    progress("Tokenizing texts", len(tokenized), len(texts))
+        finally:
+            # Also drops pending batches when the progress callback aborts the build
+            executor.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Tokenized {len(texts)} texts in {elapsed:.1f}s "
+        f"({len(texts) / max(elapsed, 1e-9):.0f} docs/s, {n_process} processes)"
+    )
+    return tokenized
+
+
+def build_bm25_index(
+    doc_ids: np.ndarray,
+    texts: Sequence[str],
+    doc_hashes: np.ndarray | None = None,
+    tokenizer: str = DEFAULT_TOKENIZER,
+    progress: ProgressCallback | None = None,
+    positions: bool = False,
+    fields: dict[str, float] | None = None,
+    field_texts: Sequence[Sequence[str]] = (),
+    text_boost: float = 1.0,
+    near_duplicates: bool = False,
+) -> BM25Index:
+    """
+    Builds a BM25 index using the given registered tokenizer, optionally with
+    token positions for phrase and proximity queries. ``fields`` maps extra
+    field names to their BM25F boosts, ``field_texts`` holds their values.
+    With ``near_duplicates``, the texts are also clustered by MinHash/LSH.
+    """
+    start = time.perf_counter()
+    if doc_hashes is None:
+        doc_hashes = hash_documents(texts, field_texts)
+    tokenized_texts = tokenize_texts(texts, tokenizer, progress=progress)
+    tokenized_fields = [
+        tokenize_texts(values, tokenizer, progress=progress) for values in field_texts
+    ]
+    minhashes = minhash_texts(texts, progress=progress) if near_duplicates else None
+    if progress:
+        progress("Building index", 0, 0)
+    index = BM25Index.from_tokenized(
+        tokenized_texts,
+        doc_ids,
+        doc_hashes,
+        positions,
+        tokenized_fields,
+        minhashes,
+        tokenizer=tokenizer,
+        fields=fields,
+        text_boost=text_boost,
+    )
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Built BM25 index for {len(texts)} texts in {elapsed:.1f}s "
+        f"({len(texts) / max(elapsed, 1e-9):.0f} docs/s)"
+    )
+    return index
+
+
+def update_index(
+    index: BM25Index,
+    doc_ids: np.ndarray,
+    texts: Sequence[str],
+    doc_hashes: np.ndarray | None = None,
+    progress: ProgressCallback | None = None,
+    field_texts: Sequence[Sequence[str]] = (),
+) -> BM25Index:
+    """
+    Brings ``index`` in line with a new corpus version without a full rebuild.
+    ``field_texts`` holds the values of the index's extra fields.
+
+    Documents whose (id, content) pair is already indexed are kept, documents
+    that disappeared or changed are tombstoned, and only new or changed texts
+    are tokenized into a delta segment. Global statistics are then recomputed
+    from the postings. The delta is merged into the base segment (dropping
+    tombstones) once it, or the share of deleted documents, grows too large.
+    """
+    if doc_hashes is None:
+        doc_hashes = hash_documents(texts, field_texts)
+
+    # Index the live (id, hash) pairs; duplicates are matched one by one
+    indexed: dict[tuple[int, int], list[int]] = {}
+    live_positions = np.flatnonzero(~index.deleted)
+    for position, key in zip(
+        live_positions.tolist(),
+        zip(index.doc_ids[live_positions].tolist(), index.doc_hashes[live_positions].tolist()),
+    ):
+        indexed.setdefault(key, []).append(position)
+
+    added = []
+    for new_position, key in enumerate(zip(doc_ids.tolist(), doc_hashes.tolist())):
+        positions = indexed.get(key)
+        if positions:
+            positions.pop()
+        else:
+            added.append(new_position)
+    removed = [position for positions in indexed.values() for position in positions]
+
+    deleted = np.array(index.deleted, dtype=bool)
+    deleted[removed] = True
+    segments = list(index.segments)
+    logger.info(
+        f"Updating BM25 index: {len(added)} texts added, {len(removed)} removed"
+    )
+    if added:
+        delta = BM25Segment.from_tokenized(
+            tokenize_texts(
+                [texts[i] for i in added], index.tokenizer, progress=progress
+            ),
+            doc_ids[added],
+            doc_hashes[added],
+            positions=index.has_positions,
+            tokenized_fields=[
+                tokenize_texts([values[i] for i in added], index.tokenizer)
+                for values in field_texts
+            ],
+            minhashes=(
+                minhash_texts([texts[i] for i in added], progress=progress)
+                if index.has_minhashes
+                else None
+            ),
+        )
+        deleted = np.concatenate((deleted, np.zeros(delta.num_docs, dtype=bool)))
+        if len(segments) > 1:
+            # Keep a single delta segment by folding the new documents into it
+            delta = merge_segments([segments.pop(), delta])
+        segments.append(delta)
+
+    if progress:
+        progress("Updating index", 0, 0)
+    delta_docs = sum(segment.num_docs for segment in segments[1:])
+    if delta_docs > MERGE_DELTA_RATIO * segments[0].num_docs or (
+        len(deleted) and deleted.mean() > MERGE_DELETED_RATIO
+    ):
+        logger.info("Merging BM25 index segments")
+        segments = [merge_segments(segments, keep=~deleted)]
+        deleted = None
+
+    updated = BM25Index(
+        segments,
+        deleted,
+        k1=index.k1,
+        b=index.b,
+        epsilon=index.epsilon,
+        tokenizer=index.tokenizer,
+        fields=index.fields,
+        text_boost=index.text_boost,
+    )
+    if not added and deleted is not None:
+        # Only tombstones changed, so the loaded statistics are outdated
+        updated.refresh_statistics()
+    return updated
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    """
+    Writes ``array`` as .npy file. Arrays memory-mapped from an earlier saved
+    index are hard-linked (or copied) instead of being written again.
+    """
+    if isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap):
+        try:
+            os.link(array.filename, path)
+        except OSError:
+            shutil.copyfile(array.filename, path)
+        return
+    np.save(path, array)
+
+
+def save_index(index: BM25Index, path: str) -> None:
+    """
+    Writes every segment's arrays as .npy files into its own directory below
+    ``path``, along with the tombstones, near-duplicate clusters and scalar
+    parameters.
+    """
+    os.makedirs(path, exist_ok=True)
+    used_names = {segment.name for segment in index.segments}
+    for number, segment in enumerate(index.segments):
+        if segment.name is None:
+            while f"segment-{number}" in used_names:
+                number += 1
+            segment.name = f"segment-{number}"
+            used_names.add(segment.name)
+        segment_path = os.path.join(path, segment.name)
+        os.makedirs(segment_path, exist_ok=True)
+        arrays = {
+            "vocab_blob": segment.vocabulary.blob,
+            "vocab_offsets": segment.vocabulary.offsets,
+            "indptr": segment.indptr,
+            "doc_indices": segment.doc_indices,
+            "term_freqs": segment.term_freqs,
+            "doc_lengths": segment.doc_lengths,
+            "doc_ids": segment.doc_ids,
+            "doc_hashes": segment.doc_hashes,
+            "idf": segment.idf,
+            "impacts": segment.impacts,
+            "max_impacts": segment.max_impacts,
+            "positions": segment.positions,
+            "position_offsets": segment.position_offsets,
+            "field_freqs": segment.field_freqs,
+            "field_lengths": segment.field_lengths,
+            "minhashes": segment.minhashes,
+            "doc_postings": segment.doc_postings,
+            "doc_indptr": segment.doc_indptr,
+        }
+        names = BM25Segment.RAW_ARRAYS + BM25Segment.DERIVED_ARRAYS
+        if segment.has_positions:
+            names += BM25Segment.POSITION_ARRAYS
+        if segment.num_fields:
+            names += BM25Segment.FIELD_ARRAYS
+        if segment.minhashes is not None:
+            names += BM25Segment.MINHASH_ARRAYS
+        if segment.doc_postings is not None:
+            names += BM25Segment.FORWARD_ARRAYS
+        for name in names:
+            _save_array(os.path.join(segment_path, f"{name}.npy"), arrays[name])
+    np.save(os.path.join(path, DELETED_FILE), index.deleted)
+    if index.clusters is not None:
+        np.save(os.path.join(path, CLUSTERS_FILE), index.clusters)
+    params = {
+        "k1": index.k1,
+        "b": index.b,
+        "epsilon": index.epsilon,
+        "tokenizer": index.tokenizer,
+        "fields": index.fields,
+        "text_boost": index.text_boost,
+        "segments": [segment.name for segment in index.segments],
+    }
+    with open(os.path.join(path, INDEX_PARAMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(params, f)
+
+
+def load_index(path: str) -> BM25Index:
     """
-    Builds a BM25 index using NLTK tokenization.
+    Opens an index written by ``save_index``. Arrays are memory-mapped read-only,
+    so only the pages touched by queries are read from disk.
     """
-    tokenized_texts = [tokenize(t) for t in texts]
-    return BM25Okapi(tokenized_texts)
+    with open(os.path.join(path, INDEX_PARAMS_FILE), "r", encoding="utf-8") as f:
+        params = json.load(f)
+    segments = []
+    for name in params.pop("segments"):
+        arrays = {
+            array_name: np.load(
+                os.path.join(path, name, f"{array_name}.npy"), mmap_mode="r"
+            )
+            for array_name in BM25Segment.RAW_ARRAYS + BM25Segment.DERIVED_ARRAYS
+        }
+        # Position, field and MinHash arrays are only present in indexes built
+        # with them, forward arrays are missing in indexes of older versions
+        for array_name in (
+            BM25Segment.POSITION_ARRAYS
+            + BM25Segment.FIELD_ARRAYS
+            + BM25Segment.MINHASH_ARRAYS
+            + BM25Segment.FORWARD_ARRAYS
+        ):
+            array_path = os.path.join(path, name, f"{array_name}.npy")
+            arrays[array_name] = (
+                np.load(array_path, mmap_mode="r") if os.path.exists(array_path) else None
+            )
+        segments.append(
+            BM25Segment(
+                Vocabulary(arrays["vocab_blob"], arrays["vocab_offsets"]),
+                arrays["indptr"],
+                arrays["doc_indices"],
+                arrays["term_freqs"],
+                arrays["doc_lengths"],
+                arrays["doc_ids"],
+                arrays["doc_hashes"],
+                idf=arrays["idf"],
+                impacts=arrays["impacts"],
+                max_impacts=arrays["max_impacts"],
+                name=name,
+                positions=arrays["positions"],
+                position_offsets=arrays["position_offsets"],
+                field_freqs=arrays["field_freqs"],
+                field_lengths=arrays["field_lengths"],
+                minhashes=arrays["minhashes"],
+                doc_postings=arrays["doc_postings"],
+                doc_indptr=arrays["doc_indptr"],
+            )
+        )
+    deleted = np.load(os.path.join(path, DELETED_FILE), mmap_mode="r")
+    clusters_path = os.path.join(path, CLUSTERS_FILE)
+    clusters = (
+        np.load(clusters_path, mmap_mode="r") if os.path.exists(clusters_path) else None
+    )
+    index = BM25Index(segments, deleted, clusters=clusters, **params)
+    index.path = path
+    shards_path = os.path.join(path, SHARDS_DIR)
+    if os.path.exists(os.path.join(shards_path, SHARDS_FILE)):
+        index.shards_path = shards_path
+    return index
+
 
-def save_index(index: BM25Okapi, path: str) -> None:
-    with open(path, "wb") as f:
-        pickle.dump(index, f)
+def shard_count(num_docs: int) -> int:
+    """Number of shards for an index of ``num_docs`` live documents, one per core at most."""
+    return max(1, min(os.cpu_count() or 1, num_docs // SHARD_MIN_DOCS))
+
+
+def save_sharded_index(
+    index: BM25Index,
+    path: str,
+    num_shards: int,
+    progress: ProgressCallback | None = None,
+) -> None:
+    """
+    Splits the live documents of ``index`` into ``num_shards`` contiguous
+    shards, each saved as an index of its own below ``path`` (without
+    positions, which are checked on the whole index). Every shard scores with
+    the statistics of the whole index, stored once in STATISTICS_FILE, and
+    keeps the index positions of its documents in DOC_POSITIONS_FILE.
+    """
+    os.makedirs(path, exist_ok=True)
+    statistics = index.corpus_statistics()
+    np.savez(
+        os.path.join(path, STATISTICS_FILE),
+        vocab_blob=statistics.vocabulary.blob,
+        vocab_offsets=statistics.vocabulary.offsets,
+        doc_freqs=statistics.doc_freqs,
+        num_docs=statistics.num_docs,
+        average_lengths=statistics.average_lengths,
+    )
+    # Shards only need the postings and lengths to score
+    segments = [
+        BM25Segment(
+            segment.vocabulary,
+            segment.indptr,
+            segment.doc_indices,
+            segment.term_freqs,
+            segment.doc_lengths,
+            segment.doc_ids,
+            segment.doc_hashes,
+            field_freqs=segment.field_freqs,
+            field_lengths=segment.field_lengths,
+        )
+        for segment in index.segments
+    ]
+    live = np.flatnonzero(~index.deleted)
+    names = []
+    for number, positions in enumerate(np.array_split(live, num_shards)):
+        if progress:
+            progress("Writing index shards", number, num_shards)
+        keep = np.zeros(index.corpus_size, dtype=bool)
+        keep[positions] = True
+        segment = merge_segments(segments, keep)
+        segment.doc_postings = segment.doc_indptr = None
+        shard = BM25Index(
+            [segment],
+            k1=index.k1,
+            b=index.b,
+            epsilon=index.epsilon,
+            tokenizer=index.tokenizer,
+            fields=index.fields,
+            text_boost=index.text_boost,
+            statistics=statistics,
+        )
+        names.append(f"shard-{number}")
+        save_index(shard, os.path.join(path, names[-1]))
+        np.save(os.path.join(path, names[-1], DOC_POSITIONS_FILE), positions)
+    with open(os.path.join(path, SHARDS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"shards": names}, f)
+    if progress:
+        progress("Writing index shards", num_shards, num_shards)
 
-def load_index(path: str) -> BM25Okapi:
-    with open(path, "rb") as f:
-        return pickle.load(f)
 
-def get_or_build_index(ground_truth: dict[str, Any], pickle_path: str) -> BM25Okapi:
-    if os.path.exists(pickle_path):
-        logger.info(f"Loading BM25 index from {pickle_path}")
-        return load_index(pickle_path)
-    logger.info(f"Building BM25 index and saving to {pickle_path}")
+def _save_entry(index: BM25Index, path: str, progress: ProgressCallback | None) -> None:
+    """Saves ``index`` into a cache entry, with shards if it is large enough."""
+    save_index(index, path)
+    num_shards = shard_count(index.num_live_docs)
+    if num_shards > 1:
+        save_sharded_index(index, os.path.join(path, SHARDS_DIR), num_shards, progress)
+
+
+def get_or_build_index(
+    ground_truth: dict[str, Any],
+    cache_dir: str | None = None,
+    source: str | None = None,
+    progress: ProgressCallback | None = None,
+    positions: bool = True,
+    near_duplicates: bool = True,
+) -> BM25Index:
+    """
+    Returns the BM25 index for the corpus in ``ground_truth``, with token
+    positions for phrase and proximity queries unless ``positions`` is unset
+    and with near-duplicate clusters unless ``near_duplicates`` is unset.
+
+    The tokenizer is chosen per input file (see ``tokenizer_for``), as are the
+    metadata fields indexed next to the texts (see ``fields_for``). Indexes are
+    cached by a hash of the corpus (ids, texts and fields) plus the tokenizer
+    fingerprint and field boosts, so an unchanged corpus is never rebuilt and a
+    changed corpus or tokenizer is never served a stale index. If the corpus
+    changed, the most recent index built from the same ``source`` file is
+    updated incrementally instead of rebuilding from scratch. ``cache_dir``
+    defaults to ``$RAG_ANNOTATOR_CACHE_DIR`` or ``~/.cache/rag-annotator``.
+    ``progress`` is called with the current stage and, where known, the
+    number of processed and total texts (0 and 0 otherwise). Large indexes
+    are also saved as shards (see ``save_sharded_index``), and the returned
+    index then has a ``shards_path`` for a ``ShardedSearcher``.
+    """
+    if progress:
+        progress("Hashing texts", 0, 0)
     texts = extract_texts_from_ground_truth(ground_truth)
-    index = build_bm25_index(texts)
-    save_index(index, pickle_path)
+    doc_ids = extract_ids_from_ground_truth(ground_truth)
+    fields, text_boost = fields_for(ground_truth)
+    field_texts = extract_fields_from_ground_truth(ground_truth, fields)
+    doc_hashes = hash_documents(texts, field_texts)
+    tokenizer = tokenizer_for(ground_truth)
+    metadata = {
+        "corpus_hash": corpus_fingerprint(doc_ids, doc_hashes),
+        "tokenizer": get_tokenizer(tokenizer).fingerprint(),
+        "documents": len(texts),
+        "positions": positions,
+        "fields": {"text": text_boost, **fields},
+        "near_duplicates": near_duplicates,
+    }
+    key_source = ":".join(
+        [
+            metadata["corpus_hash"],
+            metadata["tokenizer"],
+            str(positions),
+            str(near_duplicates),
+            json.dumps(metadata["fields"], sort_keys=True),
+        ]
+    )
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()[:32]
+    cache = IndexCache(INDEX_FORMAT_VERSION, cache_dir)
+
+    entry_path = cache.lookup(key, metadata)
+    if entry_path:
+        logger.info(f"Loading BM25 index from {entry_path}")
+        if progress:
+            progress("Loading index", 0, 0)
+        try:
+            return load_index(entry_path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load BM25 index from {entry_path}: {e}")
+
+    index = None
+    source = os.path.abspath(source) if source else None
+    if source:
+        for base_path, stored in cache.entries():
+            if (
+                stored.get("source") != source
+                or stored.get("tokenizer") != metadata["tokenizer"]
+                or stored.get("positions") != positions
+                or stored.get("fields") != metadata["fields"]
+                or stored.get("near_duplicates") != near_duplicates
+            ):
+                continue
+            logger.info(f"Updating BM25 index from {base_path}")
+            try:
+                index = update_index(
+                    load_index(base_path),
+                    doc_ids,
+                    texts,
+                    doc_hashes,
+                    progress,
+                    field_texts,
+                )
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not update BM25 index from {base_path}: {e}")
+            break
+
+    if index is None:
+        logger.info(f"Building BM25 index for {len(texts)} texts")
+        index = build_bm25_index(
+            doc_ids,
+            texts,
+            doc_hashes,
+            tokenizer,
+            progress,
+            positions,
+            fields,
+            field_texts,
+            text_boost,
+            near_duplicates,
+        )
+    if progress:
+        progress("Saving index", 0, 0)
+    entry_path = cache.store(
+        key,
+        {**metadata, "tokenizer_name": tokenizer, "source": source},
+        lambda path: _save_entry(index, path, progress),
+    )
+    logger.info(f"Saved BM25 index to {entry_path}")
+    index.path = entry_path
+    shards_path = os.path.join(entry_path, SHARDS_DIR)
+    if os.path.exists(os.path.join(shards_path, SHARDS_FILE)):
+        index.shards_path = shards_path
     return index
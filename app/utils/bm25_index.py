@@ -0,0 +1,1260 @@
+import numpy as np
+from collections import Counter
+from typing import Any, Mapping, NamedTuple, Sequence
+from app.utils.tokenizers import DEFAULT_TOKENIZER
+from app.utils.near_duplicates import cluster_signatures
+
+# Positions are combined with document positions into int64 keys (doc << 32 | pos)
+POSITION_BITS = 32
+
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    """Encodes non-negative integers as LEB128 varints (7 bits per byte)."""
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        larger = values >= (np.uint64(1) << np.uint64(shift))
+        if not larger.any():
+            break
+        num_bytes += larger
+    ends = np.cumsum(num_bytes)
+    starts = ends - num_bytes
+    encoded = np.zeros(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for byte in range(int(num_bytes.max()) if len(values) else 0):
+        present = num_bytes > byte
+        chunk = (values[present] >> np.uint64(7 * byte)) & np.uint64(0x7F)
+        continued = (num_bytes[present] > byte + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[present] + byte] = (chunk | continued).astype(np.uint8)
+    return encoded
+
+
+def decode_varints(encoded: np.ndarray) -> np.ndarray:
+    """Decodes a sequence of LEB128 varints written by ``encode_varints``."""
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    if not len(encoded):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(encoded < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)
+    parts = (encoded & 0x7F).astype(np.int64) << (7 * shifts)
+    return np.add.reduceat(parts, starts)
+
+
+def forward_arrays(doc_indices: np.ndarray, num_docs: int) -> dict[str, np.ndarray]:
+    """
+    Returns the document-major view of term-major postings: the postings of
+    local document ``d`` are ``doc_postings[doc_indptr[d]:doc_indptr[d + 1]]``.
+    """
+    dtype = np.uint32 if len(doc_indices) < 2**32 else np.int64
+    doc_indptr = np.zeros(num_docs + 1, dtype=np.int64)
+    np.cumsum(np.bincount(doc_indices, minlength=num_docs), out=doc_indptr[1:])
+    return {
+        "doc_postings": np.argsort(doc_indices, kind="stable").astype(dtype),
+        "doc_indptr": doc_indptr,
+    }
+
+
+def gather_ranges(array: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenates ``array[start:end]`` for all ranges, without a Python loop."""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if not total:
+        return array[:0]
+    first = np.cumsum(lengths) - lengths
+    indices = np.arange(total) - np.repeat(first - starts, lengths)
+    return array[indices]
+
+
+class Phrase(NamedTuple):
+    """Query constraint: the tokens must occur consecutively."""
+
+    tokens: tuple[str, ...]
+
+
+class Near(NamedTuple):
+    """
+    Query constraint: the ``left`` and ``right`` token sequences must occur at
+    most ``distance`` tokens apart (in either order).
+    """
+
+    left: tuple[str, ...]
+    right: tuple[str, ...]
+    distance: int
+
+
+class Vocabulary:
+    """
+    Sorted term vocabulary stored as a single UTF-8 blob plus offsets.
+
+    Term ids are positions in byte-wise sorted order, so looking up a term is a
+    binary search over the (possibly memory-mapped) arrays and nothing has to be
+    deserialized when an index is opened.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray) -> None:
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_sorted_terms(cls, terms: Sequence[bytes]) -> "Vocabulary":
+        """Builds the vocabulary from UTF-8 encoded terms in ascending byte order."""
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in terms], out=offsets[1:])
+        blob = np.frombuffer(b"".join(terms), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _key(self, term_id: int) -> bytes:
+        return self.blob[self.offsets[term_id] : self.offsets[term_id + 1]].tobytes()
+
+    def term(self, term_id: int) -> str:
+        """Returns the term string for a term id."""
+        return self._key(term_id).decode("utf-8")
+
+    def encoded_terms(self) -> list[bytes]:
+        """Returns all terms as UTF-8 bytes, in term id order."""
+        blob = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        return [blob[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def _lower_bound(self, key: bytes) -> int:
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self._key(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def find(self, key: bytes) -> int | None:
+        """Returns the term id of a UTF-8 encoded term, or None if it is not indexed."""
+        position = self._lower_bound(key)
+        if position < len(self) and self._key(position) == key:
+            return position
+        return None
+
+    def get(self, term: str, default: int | None = None) -> int | None:
+        """Returns the term id of ``term``, or ``default`` if it is not indexed."""
+        term_id = self.find(term.encode("utf-8"))
+        return default if term_id is None else term_id
+
+    def __contains__(self, term: str) -> bool:
+        return self.get(term) is not None
+
+    def prefix_range(self, prefix: str) -> tuple[int, int]:
+        """Returns the (start, end) term id range of all terms starting with ``prefix``."""
+        key = prefix.encode("utf-8")
+        # 0xff never occurs in UTF-8, so it sorts after every extension of the key
+        return self._lower_bound(key), self._lower_bound(key + b"\xff")
+
+
+class BM25Segment:
+    """
+    Postings of one batch of documents, stored as a term-major CSR matrix.
+
+    Row ``t`` is the inverted postings list of term ``t``: the sorted local
+    document indices ``doc_indices[indptr[t]:indptr[t + 1]]`` and the matching
+    term frequencies. ``doc_ids`` and ``doc_hashes`` identify every document so
+    later corpus versions can be diffed against the segment.
+
+    ``idf``, ``impacts`` (the BM25 contribution of every posting) and
+    ``max_impacts`` (the largest impact per term) depend on corpus-wide
+    statistics and are filled in by the owning ``BM25Index``.
+
+    Segments built with positions also store the token positions of every
+    posting, delta-encoded as varints in the byte array ``positions``; the
+    positions of posting ``p`` are the ``term_freqs[p]`` values encoded in
+    ``positions[position_offsets[p]:position_offsets[p + 1]]``.
+
+    Segments with extra fields (indexed metadata) hold postings for terms
+    occurring in any field. ``term_freqs`` and ``doc_lengths`` always refer to
+    the text field (positions as well), ``field_freqs`` (postings x fields) and
+    ``field_lengths`` (documents x fields) to the extra fields.
+
+    ``minhashes`` optionally holds the MinHash signature of every document
+    (documents x permutations) for near-duplicate detection. ``doc_postings``
+    and ``doc_indptr`` list the postings of every document (see
+    ``forward_arrays``); segments saved without them derive them on first use.
+    """
+
+    RAW_ARRAYS = (
+        "vocab_blob",
+        "vocab_offsets",
+        "indptr",
+        "doc_indices",
+        "term_freqs",
+        "doc_lengths",
+        "doc_ids",
+        "doc_hashes",
+    )
+    DERIVED_ARRAYS = ("idf", "impacts", "max_impacts")
+    POSITION_ARRAYS = ("positions", "position_offsets")
+    FIELD_ARRAYS = ("field_freqs", "field_lengths")
+    MINHASH_ARRAYS = ("minhashes",)
+    FORWARD_ARRAYS = ("doc_postings", "doc_indptr")
+
+    def __init__(
+        self,
+        vocabulary: Vocabulary,
+        indptr: np.ndarray,
+        doc_indices: np.ndarray,
+        term_freqs: np.ndarray,
+        doc_lengths: np.ndarray,
+        doc_ids: np.ndarray,
+        doc_hashes: np.ndarray,
+        idf: np.ndarray | None = None,
+        impacts: np.ndarray | None = None,
+        max_impacts: np.ndarray | None = None,
+        name: str | None = None,
+        positions: np.ndarray | None = None,
+        position_offsets: np.ndarray | None = None,
+        field_freqs: np.ndarray | None = None,
+        field_lengths: np.ndarray | None = None,
+        minhashes: np.ndarray | None = None,
+        doc_postings: np.ndarray | None = None,
+        doc_indptr: np.ndarray | None = None,
+    ) -> None:
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.doc_indices = doc_indices
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.doc_ids = doc_ids
+        self.doc_hashes = doc_hashes
+        self.idf = idf
+        self.impacts = impacts
+        self.max_impacts = max_impacts
+        self.positions = positions
+        self.position_offsets = position_offsets
+        self.field_freqs = field_freqs
+        self.field_lengths = field_lengths
+        self.minhashes = minhashes
+        self.doc_postings = doc_postings
+        self.doc_indptr = doc_indptr
+        # Directory name of the segment inside a saved index, None until saved
+        self.name = name
+
+    @classmethod
+    def from_tokenized(
+        cls,
+        tokenized_texts: Sequence[Sequence[str]],
+        doc_ids: np.ndarray,
+        doc_hashes: np.ndarray,
+        positions: bool = False,
+        tokenized_fields: Sequence[Sequence[Sequence[str]]] = (),
+        minhashes: np.ndarray | None = None,
+    ) -> "BM25Segment":
+        """
+        Builds a segment from already tokenized documents, optionally storing the
+        token positions of every posting. ``tokenized_fields`` holds the tokenized
+        documents of every extra field, ``minhashes`` their MinHash signatures.
+        """
+        vocabulary: dict[str, int] = {}
+        term_ids: list[int] = []
+        freqs: list[int] = []
+        docs: list[int] = []
+        # Posting of every token, only collected for positional segments
+        token_postings: list[int] = []
+        doc_lengths = np.zeros(len(tokenized_texts), dtype=np.int32)
+
+        for doc_index, tokens in enumerate(tokenized_texts):
+            doc_lengths[doc_index] = len(tokens)
+            if positions:
+                slots: dict[str, int] = {}
+                base = len(term_ids)
+                for token in tokens:
+                    token_postings.append(base + slots.setdefault(token, len(slots)))
+                for term in slots:
+                    term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                    docs.append(doc_index)
+                continue
+            for term, freq in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                freqs.append(freq)
+                docs.append(doc_index)
+        if positions:
+            freqs = np.bincount(
+                np.asarray(token_postings, dtype=np.int64), minlength=len(term_ids)
+            )
+
+        # (term, document, frequency, field) of the extra fields
+        field_postings: list[tuple[int, int, int, int]] = []
+        field_lengths = np.zeros((len(tokenized_texts), len(tokenized_fields)), np.int32)
+        for field, field_texts in enumerate(tokenized_fields):
+            for doc_index, tokens in enumerate(field_texts):
+                field_lengths[doc_index, field] = len(tokens)
+                for term, freq in Counter(tokens).items():
+                    term_id = vocabulary.setdefault(term, len(vocabulary))
+                    field_postings.append((term_id, doc_index, freq, field))
+
+        # Renumber terms in byte-wise sorted order to match the Vocabulary layout
+        encoded = [term.encode("utf-8") for term in vocabulary]
+        sorted_ids = sorted(range(len(encoded)), key=encoded.__getitem__)
+        new_ids = np.empty(len(encoded), dtype=np.int64)
+        new_ids[sorted_ids] = np.arange(len(encoded))
+        term_array = new_ids[np.asarray(term_ids, dtype=np.int64)]
+
+        # A stable sort keeps the document indices of each row in ascending order
+        order = np.argsort(term_array, kind="stable")
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_array, minlength=len(vocabulary)), out=indptr[1:])
+
+        position_arrays = {}
+        if positions:
+            # Token positions within their document, grouped by (sorted) posting
+            token_postings = np.asarray(token_postings, dtype=np.int64)
+            doc_starts = np.cumsum(doc_lengths, dtype=np.int64) - doc_lengths
+            token_positions = np.arange(len(token_postings)) - np.repeat(
+                doc_starts, doc_lengths
+            )
+            new_postings = np.empty(len(order), dtype=np.int64)
+            new_postings[order] = np.arange(len(order))
+            position_arrays = _encode_positions(
+                new_postings[token_postings], token_positions, len(order)
+            )
+
+        doc_indices = np.asarray(docs, dtype=np.int32)[order]
+        term_freqs = np.asarray(freqs, dtype=np.int32)[order]
+        field_arrays = {}
+        if tokenized_fields:
+            field_freqs = np.zeros(
+                (len(term_freqs), len(tokenized_fields)), dtype=np.int32
+            )
+            if field_postings:
+                fields = np.asarray(field_postings, dtype=np.int64)
+                indptr, doc_indices, term_freqs, field_freqs, position_arrays = (
+                    _add_field_postings(
+                        indptr,
+                        doc_indices,
+                        term_freqs,
+                        position_arrays,
+                        new_ids[fields[:, 0]],
+                        fields[:, 1:],
+                        len(tokenized_texts),
+                        len(tokenized_fields),
+                    )
+                )
+            field_arrays = {"field_freqs": field_freqs, "field_lengths": field_lengths}
+
+        return cls(
+            Vocabulary.from_sorted_terms([encoded[i] for i in sorted_ids]),
+            indptr,
+            doc_indices,
+            term_freqs,
+            doc_lengths,
+            np.asarray(doc_ids, dtype=np.int64),
+            np.asarray(doc_hashes, dtype=np.uint64),
+            **position_arrays,
+            **field_arrays,
+            **forward_arrays(doc_indices, len(tokenized_texts)),
+            minhashes=minhashes,
+        )
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def has_positions(self) -> bool:
+        return self.positions is not None
+
+    @property
+    def num_fields(self) -> int:
+        """Number of extra fields besides the text."""
+        return 0 if self.field_freqs is None else self.field_freqs.shape[1]
+
+    def posting_positions(self, postings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Decodes the token positions of the given postings. Returns for every
+        position the index of its posting within ``postings``, and the position.
+        """
+        freqs = np.asarray(self.term_freqs[postings], dtype=np.int64)
+        encoded = gather_ranges(
+            self.positions,
+            self.position_offsets[postings],
+            self.position_offsets[postings + 1],
+        )
+        deltas = decode_varints(encoded)
+        # Undo the delta encoding, which restarts at every posting
+        totals = np.cumsum(deltas)
+        firsts = np.cumsum(freqs) - freqs
+        owners = np.repeat(np.arange(len(postings)), freqs)
+        before = np.zeros(len(postings), dtype=np.int64)
+        nonempty = freqs > 0
+        before[nonempty] = totals[firsts[nonempty]] - deltas[firsts[nonempty]]
+        return owners, totals - before[owners]
+
+    def document_postings(self, doc_index: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the term ids and impacts of all postings of a local document."""
+        if self.doc_postings is None:
+            arrays = forward_arrays(self.doc_indices, self.num_docs)
+            self.doc_postings = arrays["doc_postings"]
+            self.doc_indptr = arrays["doc_indptr"]
+        start, end = self.doc_indptr[doc_index], self.doc_indptr[doc_index + 1]
+        postings = self.doc_postings[start:end]
+        # Postings are term-major, so the row of a posting is found in indptr
+        term_ids = np.searchsorted(self.indptr, postings, side="right") - 1
+        return term_ids, self.impacts[postings]
+
+    def term_of_posting(self) -> np.ndarray:
+        """Returns the term id of every posting (the CSR row indices)."""
+        return np.repeat(
+            np.arange(len(self.vocabulary), dtype=np.int32), np.diff(self.indptr)
+        )
+
+    def postings(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the sorted local document indices and impacts of a term."""
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.doc_indices[start:end], self.impacts[start:end]
+
+
+def _encode_positions(
+    postings: np.ndarray, token_positions: np.ndarray, num_postings: int
+) -> dict[str, np.ndarray]:
+    """Delta-encodes token positions per posting into the segment's position arrays."""
+    order = np.lexsort((token_positions, postings))
+    postings, token_positions = postings[order], token_positions[order]
+    deltas = np.diff(token_positions, prepend=0)
+    starts = np.flatnonzero(np.diff(postings, prepend=-1))
+    deltas[starts] = token_positions[starts]
+    encoded = encode_varints(deltas)
+    # Byte offset of every posting from the byte lengths of its varints
+    byte_lengths = np.diff(np.flatnonzero(encoded < 0x80), prepend=-1)
+    posting_bytes = np.bincount(postings, weights=byte_lengths, minlength=num_postings)
+    position_offsets = np.zeros(num_postings + 1, dtype=np.int64)
+    np.cumsum(posting_bytes.astype(np.int64), out=position_offsets[1:])
+    return {"positions": encoded, "position_offsets": position_offsets}
+
+
+def _add_field_postings(
+    indptr: np.ndarray,
+    doc_indices: np.ndarray,
+    term_freqs: np.ndarray,
+    position_arrays: dict[str, np.ndarray],
+    field_terms: np.ndarray,
+    field_postings: np.ndarray,
+    num_docs: int,
+    num_fields: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, dict[str, np.ndarray]]:
+    """
+    Extends text postings with the (document, frequency, field) postings of the
+    extra fields. Returns the new indptr, document indices, text frequencies
+    (0 for field-only postings), field frequencies and position arrays.
+    """
+    num_terms = len(indptr) - 1
+    text_terms = np.repeat(np.arange(num_terms, dtype=np.int64), np.diff(indptr))
+    text_keys = text_terms * num_docs + doc_indices
+    field_keys = field_terms * num_docs + field_postings[:, 0]
+    # Both key sets follow (term, document) order, as does their sorted union
+    keys = np.union1d(text_keys, field_keys)
+    text_slots = np.searchsorted(keys, text_keys)
+
+    merged_freqs = np.zeros(len(keys), dtype=np.int32)
+    merged_freqs[text_slots] = term_freqs
+    field_freqs = np.zeros((len(keys), num_fields), dtype=np.int32)
+    field_freqs[np.searchsorted(keys, field_keys), field_postings[:, 2]] = (
+        field_postings[:, 1]
+    )
+    merged_indptr = np.zeros(num_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // num_docs, minlength=num_terms), out=merged_indptr[1:])
+
+    if position_arrays:
+        # Text postings keep their order, so only the byte offsets move
+        byte_lengths = np.zeros(len(keys), dtype=np.int64)
+        byte_lengths[text_slots] = np.diff(position_arrays["position_offsets"])
+        position_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(byte_lengths, out=position_offsets[1:])
+        position_arrays = {**position_arrays, "position_offsets": position_offsets}
+    return (
+        merged_indptr,
+        (keys % num_docs).astype(np.int32),
+        merged_freqs,
+        field_freqs,
+        position_arrays,
+    )
+
+
+def merge_segments(
+    segments: Sequence[BM25Segment], keep: np.ndarray | None = None
+) -> BM25Segment:
+    """
+    Merges segments into one without re-tokenizing anything.
+
+    Documents keep their order, so the merged local indices equal the indices
+    in the concatenated document space. If ``keep`` is given (a mask over that
+    space), dropped documents are purged and the remaining ones renumbered.
+    Positions and MinHash signatures are kept if all segments store them; all
+    segments must have the same extra fields.
+    """
+    with_positions = all(segment.has_positions for segment in segments)
+    with_minhashes = all(segment.minhashes is not None for segment in segments)
+    with_fields = segments[0].field_freqs is not None
+    doc_offsets = np.cumsum([0] + [segment.num_docs for segment in segments])
+    encoded = [segment.vocabulary.encoded_terms() for segment in segments]
+    union = sorted(set().union(*encoded))
+    global_ids = {term: term_id for term_id, term in enumerate(union)}
+
+    terms, docs, freqs, position_ranges = [], [], [], []
+    position_base = 0
+    for segment, offset, segment_terms in zip(segments, doc_offsets, encoded):
+        segment_to_global = np.fromiter(
+            (global_ids[term] for term in segment_terms),
+            dtype=np.int64,
+            count=len(segment_terms),
+        )
+        terms.append(segment_to_global[segment.term_of_posting()])
+        docs.append(segment.doc_indices.astype(np.int64) + offset)
+        freqs.append(np.asarray(segment.term_freqs))
+        if with_positions:
+            # Byte ranges of every posting's positions in the concatenated arrays
+            position_ranges.append(segment.position_offsets + position_base)
+            position_base += len(segment.positions)
+    terms_array = np.concatenate(terms) if terms else np.zeros(0, dtype=np.int64)
+    docs_array = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int64)
+    freqs_array = np.concatenate(freqs) if freqs else np.zeros(0, dtype=np.int32)
+
+    doc_lengths = np.concatenate([segment.doc_lengths for segment in segments])
+    doc_ids = np.concatenate([segment.doc_ids for segment in segments])
+    doc_hashes = np.concatenate([segment.doc_hashes for segment in segments])
+    if with_fields:
+        field_freqs = np.concatenate([segment.field_freqs for segment in segments])
+        field_lengths = np.concatenate([segment.field_lengths for segment in segments])
+    minhashes = None
+    if with_minhashes:
+        minhashes = np.concatenate([segment.minhashes for segment in segments])
+    if with_positions:
+        position_starts = np.concatenate([r[:-1] for r in position_ranges])
+        position_ends = np.concatenate([r[1:] for r in position_ranges])
+    if keep is not None:
+        kept_postings = keep[docs_array]
+        new_ordinals = np.cumsum(keep) - 1
+        terms_array = terms_array[kept_postings]
+        docs_array = new_ordinals[docs_array[kept_postings]]
+        freqs_array = freqs_array[kept_postings]
+        if with_positions:
+            position_starts = position_starts[kept_postings]
+            position_ends = position_ends[kept_postings]
+        if with_fields:
+            field_freqs = field_freqs[kept_postings]
+            field_lengths = field_lengths[keep]
+        if with_minhashes:
+            minhashes = minhashes[keep]
+        doc_lengths, doc_ids, doc_hashes = (
+            doc_lengths[keep],
+            doc_ids[keep],
+            doc_hashes[keep],
+        )
+
+    # Terms that only occurred in purged documents disappear from the vocabulary
+    row_sizes = np.bincount(terms_array, minlength=len(union))
+    used = np.flatnonzero(row_sizes)
+    compact_ids = np.cumsum(row_sizes > 0) - 1
+    terms_array = compact_ids[terms_array]
+
+    order = np.lexsort((docs_array, terms_array))
+    indptr = np.zeros(len(used) + 1, dtype=np.int64)
+    np.cumsum(row_sizes[used], out=indptr[1:])
+
+    position_arrays = {}
+    if with_positions:
+        # Positions are delta-encoded per posting, so their bytes are moved as is
+        position_starts, position_ends = position_starts[order], position_ends[order]
+        position_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(position_ends - position_starts, out=position_offsets[1:])
+        position_arrays = {
+            "positions": gather_ranges(
+                np.concatenate([segment.positions for segment in segments]),
+                position_starts,
+                position_ends,
+            ),
+            "position_offsets": position_offsets,
+        }
+    field_arrays = {}
+    if with_fields:
+        field_arrays = {
+            "field_freqs": np.asarray(field_freqs[order], dtype=np.int32),
+            "field_lengths": np.asarray(field_lengths, dtype=np.int32),
+        }
+    return BM25Segment(
+        Vocabulary.from_sorted_terms([union[i] for i in used]),
+        indptr,
+        docs_array[order].astype(np.int32),
+        freqs_array[order].astype(np.int32),
+        doc_lengths.astype(np.int32),
+        doc_ids.astype(np.int64),
+        doc_hashes.astype(np.uint64),
+        **position_arrays,
+        **field_arrays,
+        **forward_arrays(docs_array[order], len(doc_lengths)),
+        minhashes=minhashes,
+    )
+
+
+class CorpusStatistics(NamedTuple):
+    """
+    Corpus-wide BM25 statistics: the live document frequency of every term of
+    ``vocabulary``, the number of live documents and their average text length
+    followed by the average length of every extra field.
+    """
+
+    vocabulary: Vocabulary
+    doc_freqs: np.ndarray
+    num_docs: int
+    average_lengths: np.ndarray
+
+    @staticmethod
+    def inverse_document_frequencies(
+        doc_freqs: np.ndarray, num_docs: int, epsilon: float
+    ) -> np.ndarray:
+        """Okapi IDF with the epsilon floor of ``rank_bm25`` for negative values."""
+        present = doc_freqs > 0
+        idf = np.log(num_docs - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        if present.any():
+            idf[present & (idf < 0)] = epsilon * idf[present].mean()
+        return idf
+
+
+class BM25Index:
+    """
+    Okapi BM25 index over one base segment plus optional delta segments.
+
+    Documents are addressed by their position in the concatenated document
+    space of all segments; ``deleted`` marks tombstoned positions, which are
+    never returned. IDF and document length normalisation use the live
+    documents of all segments and are folded into each segment's precomputed
+    ``impacts``, so scoring a query is a handful of vectorised adds over the
+    postings of its terms. The largest impact of every term serves as an upper
+    bound for MaxScore pruning in ``top_k``.
+
+    Scoring follows ``rank_bm25.BM25Okapi`` (including its epsilon floor for
+    negative IDF values), so an index updated through delta segments ranks
+    exactly like one rebuilt from scratch. ``tokenizer`` records the registered
+    tokenizer name that documents were indexed with; queries must use it too.
+
+    With extra ``fields`` (name -> boost, in segment field order) or a
+    ``text_boost`` other than 1, impacts follow BM25F instead: the boosted,
+    per-field length normalised term frequencies are summed into one pseudo
+    frequency before saturation. Queries still add one impact per posting, so
+    fields cost nothing at query time.
+
+    An index given shared ``statistics`` (see ``corpus_statistics``) scores
+    its documents as part of that larger corpus, which is how the shards of a
+    sharded index rank exactly like the whole index.
+
+    If all segments store MinHash signatures, ``clusters`` maps every document
+    position to the representative of its near-duplicate cluster (see
+    ``near_duplicates.cluster_signatures``); it is recomputed unless given.
+    """
+
+    def __init__(
+        self,
+        segments: Sequence[BM25Segment],
+        deleted: np.ndarray | None = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        tokenizer: str = DEFAULT_TOKENIZER,
+        fields: dict[str, float] | None = None,
+        text_boost: float = 1.0,
+        clusters: np.ndarray | None = None,
+        statistics: CorpusStatistics | None = None,
+    ) -> None:
+        self.segments = list(segments)
+        self.statistics = statistics
+        # Directory the index was loaded from or cached in, and of its saved
+        # shards (see save_sharded_index)
+        self.path: str | None = None
+        self.shards_path: str | None = None
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.tokenizer = tokenizer
+        self.fields = dict(fields or {})
+        self.text_boost = text_boost
+        if any(segment.num_fields != len(self.fields) for segment in self.segments):
+            raise ValueError(f"Segments do not match the index fields {self.fields}")
+
+        self.doc_offsets = np.cumsum([0] + [segment.num_docs for segment in segments])
+        self.corpus_size = int(self.doc_offsets[-1])
+        self.deleted = (
+            np.zeros(self.corpus_size, dtype=bool) if deleted is None else deleted
+        )
+        self.has_deletions = bool(self.deleted.any())
+        # Live document frequencies of the terms of segments with deletions,
+        # computed on first use by expand_prefix
+        self._live_doc_freqs: dict[int, np.ndarray | None] = {}
+        if len(self.segments) == 1:
+            self.doc_ids = self.segments[0].doc_ids
+            self.doc_hashes = self.segments[0].doc_hashes
+        else:
+            self.doc_ids = np.concatenate([s.doc_ids for s in self.segments])
+            self.doc_hashes = np.concatenate([s.doc_hashes for s in self.segments])
+
+        # Derived arrays are recomputed unless they were loaded with the index
+        if any(segment.impacts is None for segment in self.segments):
+            self.refresh_statistics()
+        self.clusters = clusters
+        if clusters is None and self.has_minhashes:
+            self.refresh_clusters()
+
+    @classmethod
+    def from_tokenized(
+        cls,
+        tokenized_texts: Sequence[Sequence[str]],
+        doc_ids: np.ndarray,
+        doc_hashes: np.ndarray,
+        positions: bool = False,
+        tokenized_fields: Sequence[Sequence[Sequence[str]]] = (),
+        minhashes: np.ndarray | None = None,
+        **params: Any,
+    ) -> "BM25Index":
+        """
+        Builds a single-segment index from already tokenized documents, storing
+        token positions if ``positions`` is set. ``tokenized_fields`` holds the
+        tokenized documents of every field in ``params["fields"]``, ``minhashes``
+        the documents' MinHash signatures.
+        """
+        return cls(
+            [
+                BM25Segment.from_tokenized(
+                    tokenized_texts,
+                    doc_ids,
+                    doc_hashes,
+                    positions=positions,
+                    tokenized_fields=tokenized_fields,
+                    minhashes=minhashes,
+                )
+            ],
+            **params,
+        )
+
+    @property
+    def has_positions(self) -> bool:
+        return all(segment.has_positions for segment in self.segments)
+
+    @property
+    def has_minhashes(self) -> bool:
+        return all(segment.minhashes is not None for segment in self.segments)
+
+    def refresh_clusters(self) -> None:
+        """Recomputes the near-duplicate clusters of the live documents."""
+        minhashes = np.concatenate([segment.minhashes for segment in self.segments])
+        self.clusters = cluster_signatures(minhashes, ~self.deleted)
+
+    @property
+    def num_live_docs(self) -> int:
+        return self.corpus_size - int(self.deleted.sum())
+
+    def _segment_deleted(self, index: int) -> np.ndarray:
+        return self.deleted[self.doc_offsets[index] : self.doc_offsets[index + 1]]
+
+    def _term_statistics(self, live: np.ndarray) -> tuple[list[np.ndarray], np.ndarray]:
+        """
+        Maps the terms of all segments into one term id space (the base segment's
+        ids, then unseen terms of later segments). Returns the term ids of every
+        segment and the live document frequency of every term.
+        """
+        base_vocabulary = self.segments[0].vocabulary
+        extra_terms: dict[bytes, int] = {}
+        global_ids = [np.arange(len(base_vocabulary), dtype=np.int64)]
+        for segment in self.segments[1:]:
+            ids = []
+            for term in segment.vocabulary.encoded_terms():
+                term_id = base_vocabulary.find(term)
+                if term_id is None:
+                    term_id = extra_terms.setdefault(
+                        term, len(base_vocabulary) + len(extra_terms)
+                    )
+                ids.append(term_id)
+            global_ids.append(np.asarray(ids, dtype=np.int64))
+
+        # Document frequencies only count live documents
+        doc_freqs = np.zeros(len(base_vocabulary) + len(extra_terms), dtype=np.float64)
+        for index, (segment, ids) in enumerate(zip(self.segments, global_ids)):
+            segment_deleted = self._segment_deleted(index)
+            if segment_deleted.any():
+                alive = ~segment_deleted[segment.doc_indices]
+                counts = np.bincount(
+                    segment.term_of_posting()[alive], minlength=len(segment.vocabulary)
+                )
+            else:
+                counts = np.diff(segment.indptr)
+            doc_freqs[ids] += counts
+        return global_ids, doc_freqs
+
+    def _lengths(self) -> np.ndarray:
+        """Text length (first column) and extra field lengths of every document."""
+        columns = [
+            np.concatenate([segment.doc_lengths for segment in self.segments])[:, None]
+        ]
+        if self.fields:
+            columns.append(
+                np.concatenate([segment.field_lengths for segment in self.segments])
+            )
+        return np.hstack(columns).astype(np.float64)
+
+    def corpus_statistics(self) -> CorpusStatistics:
+        """Returns the statistics of the live documents over all segments."""
+        live = ~self.deleted
+        global_ids, doc_freqs = self._term_statistics(live)
+        terms: list[bytes] = [b""] * len(doc_freqs)
+        for segment, ids in zip(self.segments, global_ids):
+            for term_id, term in zip(ids.tolist(), segment.vocabulary.encoded_terms()):
+                terms[term_id] = term
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        lengths = self._lengths()
+        return CorpusStatistics(
+            Vocabulary.from_sorted_terms([terms[i] for i in order]),
+            doc_freqs[order],
+            int(live.sum()),
+            lengths[live].mean(axis=0) if live.any() else np.zeros(lengths.shape[1]),
+        )
+
+    def refresh_statistics(self) -> None:
+        """
+        Recomputes corpus-wide statistics (unless the index scores with shared
+        ``statistics``) and every segment's derived arrays. Runs vectorised over
+        the postings, without touching any text.
+        """
+        live = ~self.deleted
+        lengths = self._lengths()
+        if self.statistics is None:
+            global_ids, doc_freqs = self._term_statistics(live)
+            num_docs = int(live.sum())
+            average_lengths = (
+                lengths[live].mean(axis=0) if num_docs else np.zeros(lengths.shape[1])
+            )
+        else:
+            statistics = self.statistics
+            term_ids = {
+                term: term_id
+                for term_id, term in enumerate(statistics.vocabulary.encoded_terms())
+            }
+            # Terms unknown to the statistics get the last id, a frequency of zero
+            global_ids = [
+                np.fromiter(
+                    (
+                        term_ids.get(term, len(term_ids))
+                        for term in segment.vocabulary.encoded_terms()
+                    ),
+                    dtype=np.int64,
+                    count=len(segment.vocabulary),
+                )
+                for segment in self.segments
+            ]
+            doc_freqs = np.append(statistics.doc_freqs, 0.0)
+            num_docs = statistics.num_docs
+            average_lengths = np.asarray(statistics.average_lengths, dtype=np.float64)
+
+        idf = CorpusStatistics.inverse_document_frequencies(
+            doc_freqs, num_docs, self.epsilon
+        )
+        if self.fields or self.text_boost != 1:
+            self._refresh_field_impacts(idf, global_ids, lengths, average_lengths)
+            return
+
+        avgdl = float(average_lengths[0])
+        length_norm = (
+            self.k1 * (1 - self.b + self.b * lengths[:, 0] / avgdl) if avgdl else None
+        )
+        for segment, ids, offset in zip(self.segments, global_ids, self.doc_offsets):
+            segment.idf = idf[ids]
+            if length_norm is None or not len(segment.doc_indices):
+                segment.impacts = np.zeros(len(segment.doc_indices), dtype=np.float32)
+                segment.max_impacts = np.zeros(len(ids), dtype=np.float32)
+                continue
+            tf = segment.term_freqs.astype(np.float64)
+            impacts = (
+                segment.idf[segment.term_of_posting()]
+                * tf
+                * (self.k1 + 1)
+                / (tf + length_norm[offset + segment.doc_indices])
+            )
+            segment.impacts = impacts.astype(np.float32)
+            # Every term has at least one posting, so no row of reduceat is empty
+            segment.max_impacts = np.maximum.reduceat(
+                segment.impacts, segment.indptr[:-1]
+            )
+
+    def _length_norms(self, lengths: np.ndarray, average: np.ndarray) -> np.ndarray:
+        """BM25 length normalisation of every document (column) of ``lengths``."""
+        safe_average = np.where(average > 0, average, 1.0)
+        return np.where(average > 0, 1 - self.b + self.b * lengths / safe_average, 1.0)
+
+    def _refresh_field_impacts(
+        self,
+        idf: np.ndarray,
+        global_ids: list[np.ndarray],
+        lengths: np.ndarray,
+        average_lengths: np.ndarray,
+    ) -> None:
+        """Fills in BM25F impacts from the text and extra field frequencies."""
+        norms = self._length_norms(lengths, average_lengths)
+        boosts = np.asarray(list(self.fields.values()), dtype=np.float64)
+        for segment, ids, offset in zip(self.segments, global_ids, self.doc_offsets):
+            segment.idf = idf[ids]
+            if not len(segment.doc_indices):
+                segment.impacts = np.zeros(0, dtype=np.float32)
+                segment.max_impacts = np.zeros(len(ids), dtype=np.float32)
+                continue
+            docs = offset + segment.doc_indices
+            pseudo_tf = self.text_boost * segment.term_freqs / norms[docs, 0]
+            if self.fields:
+                pseudo_tf += (segment.field_freqs / norms[docs, 1:]) @ boosts
+            impacts = (
+                segment.idf[segment.term_of_posting()]
+                * pseudo_tf
+                * (self.k1 + 1)
+                / (pseudo_tf + self.k1)
+            )
+            segment.impacts = impacts.astype(np.float32)
+            segment.max_impacts = np.maximum.reduceat(
+                segment.impacts, segment.indptr[:-1]
+            )
+
+    def _resolve_terms(
+        self, query_tokens: Sequence[str] | Mapping[str, float]
+    ) -> list[tuple[list[tuple[int, int]], float, float]]:
+        """
+        Looks up query tokens in every segment. Returns, per distinct known term,
+        its (segment, term id) locations, its query weight (multiplicity, unless
+        ``query_tokens`` maps terms to weights) and its score upper bound (weight
+        times the largest impact over all segments).
+        """
+        if not isinstance(query_tokens, Mapping):
+            query_tokens = Counter(query_tokens)
+        terms = []
+        for token, count in query_tokens.items():
+            locations = []
+            bound = 0.0
+            for index, segment in enumerate(self.segments):
+                term_id = segment.vocabulary.get(token)
+                if term_id is not None:
+                    locations.append((index, term_id))
+                    bound = max(bound, float(segment.max_impacts[term_id]))
+            if locations:
+                terms.append((locations, count, count * bound))
+        return terms
+
+    def _postings(
+        self, locations: list[tuple[int, int]], excluded: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the sorted live document positions and impacts of a term, leaving
+        out ``excluded`` documents (see ``_exclusion``).
+        """
+        if len(locations) == 1:
+            index, term_id = locations[0]
+            docs, impacts = self.segments[index].postings(term_id)
+            if index:
+                docs = docs.astype(np.int64) + self.doc_offsets[index]
+        else:
+            parts = [
+                self.segments[index].postings(term_id) for index, term_id in locations
+            ]
+            docs = np.concatenate(
+                [
+                    part_docs.astype(np.int64) + self.doc_offsets[index]
+                    for (index, _), (part_docs, _) in zip(locations, parts)
+                ]
+            )
+            impacts = np.concatenate([part_impacts for _, part_impacts in parts])
+        if self.has_deletions:
+            alive = ~self.deleted[docs]
+            docs, impacts = docs[alive], impacts[alive]
+        if excluded is not None and len(docs):
+            if excluded.dtype == bool:
+                keep = ~excluded[docs]
+            else:
+                positions = np.searchsorted(excluded, docs)
+                positions[positions == len(excluded)] = 0
+                keep = excluded[positions] != docs
+            docs, impacts = docs[keep], impacts[keep]
+        return docs, impacts
+
+    def _exclusion(
+        self, exclude: np.ndarray | Sequence[int] | None
+    ) -> np.ndarray | None:
+        """
+        Normalizes excluded documents to either a boolean mask over all positions
+        or a sorted array of positions, whichever ``exclude`` already is.
+        """
+        if exclude is None:
+            return None
+        exclude = np.asarray(exclude)
+        if exclude.dtype == bool:
+            if len(exclude) != self.corpus_size:
+                raise ValueError(
+                    f"Exclusion mask has {len(exclude)} entries, "
+                    f"expected {self.corpus_size}"
+                )
+            return exclude if exclude.any() else None
+        if not len(exclude):
+            return None
+        return np.unique(exclude.astype(np.int64))
+
+    def get_scores(self, query_tokens: Sequence[str]) -> np.ndarray:
+        """Returns the BM25 score of every document position for the query tokens."""
+        scores = np.zeros(self.corpus_size, dtype=np.float32)
+        for locations, count, _ in self._resolve_terms(query_tokens):
+            docs, impacts = self._postings(locations)
+            # Document positions are unique within a term, so fancy-index add is safe
+            scores[docs] += count * impacts
+        return scores
+
+    def _occurrences(self, tokens: Sequence[str]) -> np.ndarray:
+        """
+        Returns the sorted keys ``doc << POSITION_BITS | start`` of every live
+        occurrence of the consecutive ``tokens``. Only documents containing all
+        tokens are decoded, by intersecting the postings first.
+        """
+        found = []
+        for index, segment in enumerate(self.segments):
+            term_ids = [segment.vocabulary.get(token) for token in tokens]
+            if not tokens or None in term_ids:
+                continue
+            rows = [segment.indptr[term_id] for term_id in term_ids]
+            row_docs = [
+                segment.doc_indices[segment.indptr[term_id] : segment.indptr[term_id + 1]]
+                for term_id in term_ids
+            ]
+            docs = row_docs[0]
+            for other in row_docs[1:]:
+                docs = np.intersect1d(docs, other, assume_unique=True)
+            if not len(docs):
+                continue
+
+            keys = None
+            for offset, (row, term_docs) in enumerate(zip(rows, row_docs)):
+                postings = row + np.searchsorted(term_docs, docs)
+                owners, positions = segment.posting_positions(postings)
+                # Shift every token back to the start of the sequence
+                term_keys = (docs[owners].astype(np.int64) << POSITION_BITS) + (
+                    positions - offset
+                )
+                keys = (
+                    term_keys
+                    if keys is None
+                    else np.intersect1d(keys, term_keys, assume_unique=True)
+                )
+            if not len(keys):
+                continue
+            keys = keys + (int(self.doc_offsets[index]) << POSITION_BITS)
+            if self.has_deletions:
+                keys = keys[~self.deleted[keys >> POSITION_BITS]]
+            found.append(np.sort(keys))
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def positional_matches(self, constraints: Sequence[Phrase | Near]) -> np.ndarray:
+        """
+        Returns the sorted positions of the documents satisfying all phrase and
+        proximity constraints. Requires an index built with positions.
+        """
+        if not self.has_positions:
+            raise ValueError("Index was built without token positions")
+        matched = None
+        for constraint in constraints:
+            if isinstance(constraint, Phrase):
+                docs = np.unique(self._occurrences(constraint.tokens) >> POSITION_BITS)
+            else:
+                left = self._occurrences(constraint.left)
+                right = self._occurrences(constraint.right)
+                # Start offsets (right - left) at which the sequences are close enough
+                low = -(constraint.distance + len(constraint.right) - 1)
+                high = constraint.distance + len(constraint.left) - 1
+                in_range = np.searchsorted(
+                    right, left + high, side="right"
+                ) - np.searchsorted(right, left + low, side="left")
+                # An occurrence of ``x NEAR x`` is in range of itself, so two
+                # distinct occurrences are needed
+                near = in_range > int(constraint.left == constraint.right)
+                docs = np.unique(left[near] >> POSITION_BITS)
+            matched = docs if matched is None else np.intersect1d(matched, docs)
+            if not len(matched):
+                break
+        return np.zeros(0, dtype=np.int64) if matched is None else matched
+
+    def _segment_live_doc_freqs(self, index: int) -> np.ndarray | None:
+        """
+        Live document frequency of every term of a segment, or None if the
+        segment has no deleted documents (its ``indptr`` counts are exact then).
+        """
+        if index not in self._live_doc_freqs:
+            segment = self.segments[index]
+            segment_deleted = self._segment_deleted(index)
+            doc_freqs = None
+            if segment_deleted.any():
+                alive = ~segment_deleted[segment.doc_indices]
+                doc_freqs = np.bincount(
+                    segment.term_of_posting()[alive], minlength=len(segment.vocabulary)
+                )
+            self._live_doc_freqs[index] = doc_freqs
+        return self._live_doc_freqs[index]
+
+    def expand_prefix(self, prefix: str, limit: int) -> list[str]:
+        """
+        Returns up to ``limit`` indexed terms starting with ``prefix``: the prefix
+        itself if it is a term, then the others by descending live document
+        frequency. Only two binary searches per segment plus a partial sort of
+        the range. Every segment contributes its ``limit`` most frequent terms,
+        so with several segments a term that is frequent overall but in none
+        of them alone can be missed.
+        """
+        doc_freqs: dict[str, int] = {}
+        for index, segment in enumerate(self.segments):
+            start, end = segment.vocabulary.prefix_range(prefix)
+            if start == end:
+                continue
+            live_doc_freqs = self._segment_live_doc_freqs(index)
+            if live_doc_freqs is None:
+                counts = np.diff(segment.indptr[start : end + 1])
+            else:
+                counts = live_doc_freqs[start:end]
+            if len(counts) > limit:
+                top = np.argpartition(-counts, limit - 1)[:limit]
+            else:
+                top = np.arange(len(counts))
+            # The prefix itself sorts before its extensions
+            if segment.vocabulary.term(start) == prefix and 0 not in top:
+                top = np.append(top, 0)
+            for term_id, count in zip((start + top).tolist(), counts[top].tolist()):
+                term = segment.vocabulary.term(term_id)
+                doc_freqs[term] = doc_freqs.get(term, 0) + count
+        # Terms only left in deleted documents expand to nothing
+        terms = [term for term in doc_freqs if doc_freqs[term] or term == prefix]
+        terms.sort(key=lambda term: (term != prefix, -doc_freqs[term], term))
+        return terms[:limit]
+
+    def feedback_terms(
+        self, doc_positions: Sequence[int], num_terms: int
+    ) -> dict[str, float]:
+        """
+        Rocchio centroid of the given (relevant) documents: the mean BM25 impact
+        of every term over them, reduced to the ``num_terms`` heaviest terms.
+        The documents' postings are read through the document-major arrays of
+        their segments, so this only touches the postings of those documents.
+        """
+        weights: Counter[str] = Counter()
+        positions = [p for p in doc_positions if not self.deleted[p]]
+        for position in positions:
+            index = int(np.searchsorted(self.doc_offsets, position, side="right")) - 1
+            segment = self.segments[index]
+            term_ids, impacts = segment.document_postings(
+                position - int(self.doc_offsets[index])
+            )
+            for term_id, impact in zip(term_ids.tolist(), impacts.tolist()):
+                weights[segment.vocabulary.term(term_id)] += impact / len(positions)
+        return dict(weights.most_common(num_terms))
+
+    def matches(
+        self,
+        query_tokens: Sequence[str] | Mapping[str, float],
+        exclude: np.ndarray | Sequence[int] | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the positions (ascending) and scores of all documents matching
+        any query term, leaving out ``exclude`` like ``top_k``. Scores keep the
+        float64 precision they are ranked by in ``top_k``. Like in ``top_k``,
+        ``query_tokens`` may also map terms to (non-negative) query weights.
+        """
+        excluded = self._exclusion(exclude)
+        postings = []
+        for locations, count, _ in self._resolve_terms(query_tokens):
+            docs, impacts = self._postings(locations, excluded)
+            postings.append((docs, count * impacts.astype(np.float64)))
+        if not postings:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        candidates, scores = self._accumulate(postings)
+        matched = scores > 0
+        return candidates[matched], scores[matched]
+
+    def top_k(
+        self,
+        query_tokens: Sequence[str] | Mapping[str, float],
+        k: int,
+        exclude: np.ndarray | Sequence[int] | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the positions and scores of the ``k`` best matching documents,
+        ordered by descending score. Documents without any query term are skipped,
+        as are the documents in ``exclude`` (positions or a boolean mask over all
+        positions); they are dropped from the postings before ranking, so the
+        result is the true top k of the remaining documents. Impacts of repeated
+        query tokens are added up; a mapping of terms to weights scales them.
+
+        Uses vectorised MaxScore: terms are visited by descending upper bound, and
+        the k-th largest impact of each visited term gives a lower bound on the
+        final k-th score. As soon as the summed bounds of the remaining terms
+        drop below it, no document missing from the postings seen so far can
+        reach the top k, so the remaining (long, low-IDF) postings lists are only
+        probed for existing candidates via binary search, and candidates that
+        can no longer reach the threshold are dropped along the way.
+        """
+        terms = sorted(
+            self._resolve_terms(query_tokens), key=lambda term: term[2], reverse=True
+        )
+        if k <= 0 or not terms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        excluded = self._exclusion(exclude)
+
+        # Split off the essential terms whose postings may contain unseen top-k docs
+        remaining_bound = sum(bound for _, _, bound in terms)
+        threshold = 0.0
+        essential: list[tuple[np.ndarray, np.ndarray]] = []
+        while len(essential) < len(terms) and remaining_bound > threshold:
+            locations, count, bound = terms[len(essential)]
+            docs, impacts = self._postings(locations, excluded)
+            weighted = count * impacts.astype(np.float64)
+            if len(weighted) >= k:
+                threshold = max(threshold, float(np.partition(weighted, -k)[-k]))
+            essential.append((docs, weighted))
+            remaining_bound -= bound
+
+        candidates, scores = self._accumulate(essential)
+        for locations, count, bound in terms[len(essential) :]:
+            if len(candidates) >= k:
+                threshold = max(threshold, float(np.partition(scores, -k)[-k]))
+                viable = scores + remaining_bound >= threshold
+                candidates, scores = candidates[viable], scores[viable]
+            # Candidates never include excluded documents, so no need to filter
+            docs, impacts = self._postings(locations)
+            if len(docs):
+                positions = np.searchsorted(docs, candidates)
+                positions[positions == len(docs)] = 0
+                hits = docs[positions] == candidates
+                scores[hits] += count * impacts[positions[hits]]
+            remaining_bound -= bound
+
+        matched = scores > 0
+        candidates, scores = candidates[matched], scores[matched]
+        if k < len(candidates):
+            best = np.argpartition(scores, -k)[-k:]
+            candidates, scores = candidates[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return candidates[order], scores[order].astype(np.float32)
+
+    def _accumulate(
+        self, postings: list[tuple[np.ndarray, np.ndarray]]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Sums weighted postings lists into sorted candidate documents and scores."""
+        if not postings:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        docs = np.concatenate([docs for docs, _ in postings])
+        weights = np.concatenate([weights for _, weights in postings])
+        if not len(docs):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        if len(docs) * 8 >= self.corpus_size:
+            # Dense accumulation is cheaper once postings cover a good part of the corpus
+            dense = np.bincount(docs, weights=weights, minlength=self.corpus_size)
+            candidates = np.flatnonzero(dense)
+            return candidates, dense[candidates]
+        order = np.argsort(docs, kind="stable")
+        docs, weights = docs[order], weights[order]
+        starts = np.flatnonzero(np.diff(docs, prepend=-1))
+        return docs[starts].astype(np.int64), np.add.reduceat(weights, starts)
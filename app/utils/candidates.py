@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import contextlib
+import hashlib
+import logging
+import tempfile
+import numpy as np
+from typing import Any, Sequence
+from app.utils.bm25_index import BM25Index
+from app.utils.bm25_handler import (
+    BM25Searcher,
+    get_or_build_index,
+    load_index,
+    save_index,
+)
+from app.utils.processes import process_pool
+from app.utils.tokenizers import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+CANDIDATES_SUFFIX = ".candidates.json"
+CANDIDATES_FORMAT_VERSION = 1
+# Candidates stored per point, enough for several pages of results
+DEFAULT_CANDIDATES_K = 100
+# Queries per process pool task
+QUERY_CHUNK_SIZE = 64
+
+# Searcher of the worker processes, opened once per process
+_worker_searcher: BM25Searcher | None = None
+
+
+def candidates_path(data_file_path: str) -> str:
+    """Returns the sidecar file next to an annotation file (data.json -> data.candidates.json)."""
+    root, _ = os.path.splitext(data_file_path)
+    return root + CANDIDATES_SUFFIX
+
+
+def point_query(point: dict[str, Any]) -> str:
+    """The default BM25 query of a point: its description plus its keywords."""
+    return " ".join([point.get("description", ""), *point.get("keywords", [])]).strip()
+
+
+def index_fingerprint(index: BM25Index) -> str:
+    """
+    Hashes the live (id, content) pairs, the tokenizer and the field boosts of an
+    index, independent of document order, so an incrementally updated index matches a rebuilt one.
+    """
+    live = np.flatnonzero(~index.deleted)
+    doc_ids, doc_hashes = index.doc_ids[live], index.doc_hashes[live]
+    order = np.lexsort((doc_hashes, doc_ids))
+    digest = hashlib.sha256()
+    digest.update(doc_ids[order].astype("<i8").tobytes())
+    digest.update(doc_hashes[order].astype("<u8").tobytes())
+    digest.update(get_tokenizer(index.tokenizer).fingerprint().encode("utf-8"))
+    if index.fields or index.text_boost != 1.0:
+        fields = {"text": index.text_boost, **index.fields}
+        digest.update(json.dumps(fields, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _init_worker(index_path: str) -> None:
+    global _worker_searcher
+    _worker_searcher = BM25Searcher(load_index(index_path), cache_size=0)
+
+
+def _search_queries(
+    searcher: BM25Searcher, queries: Sequence[tuple[str, list[int], int]]
+) -> list[tuple[list[int], list[float]]]:
+    results = []
+    for query, exclude, k in queries:
+        ranked = searcher.search_results(query, k, exclude)
+        results.append(
+            ([result.doc_id for result in ranked], [result.score for result in ranked])
+        )
+    return results
+
+
+def _search_chunk(
+    queries: Sequence[tuple[str, list[int], int]],
+) -> list[tuple[list[int], list[float]]]:
+    return _search_queries(_worker_searcher, queries)
+
+
+def precompute_candidates(
+    ground_truth: dict[str, Any],
+    index: BM25Index,
+    k: int = DEFAULT_CANDIDATES_K,
+    n_process: int | None = None,
+) -> dict[str, Any]:
+    """
+    Runs the default query of every point against ``index`` and returns the
+    ranked candidate IDs and scores per query, leaving out the texts already
+    fetched for the point. Points sharing a query share its search: only the
+    texts fetched for all of them are left out, and enough further candidates
+    are kept for each point to have ``k`` once the app drops its own fetched
+    texts. Queries are spread over a process pool (all cores by default),
+    every worker memory-maps the same saved index: the cache entry ``index``
+    was loaded from or stored in, if any.
+    """
+    start = time.perf_counter()
+    id_to_doc_index = {
+        doc_id: doc_index
+        for doc_index, doc_id in enumerate(index.doc_ids.tolist())
+        if not index.deleted[doc_index]
+    }
+    exclusions: dict[str, list[set[int]]] = {}
+    for point in ground_truth.get("points", []):
+        query = point_query(point)
+        if query:
+            exclusions.setdefault(query, []).append(
+                {
+                    id_to_doc_index[item["id"]]
+                    for item in point.get("fetched_texts", [])
+                    if item.get("id") in id_to_doc_index
+                }
+            )
+
+    items = []
+    for query, excluded in exclusions.items():
+        shared = set.intersection(*excluded)
+        extra = max(len(point_excluded - shared) for point_excluded in excluded)
+        items.append((query, sorted(shared), k + extra))
+
+    chunks = [
+        items[i : i + QUERY_CHUNK_SIZE] for i in range(0, len(items), QUERY_CHUNK_SIZE)
+    ]
+    n_process = max(1, min(n_process or os.cpu_count() or 1, len(chunks)))
+    if n_process == 1:
+        results = _search_queries(BM25Searcher(index, cache_size=0), items)
+    else:
+        results = []
+        with contextlib.ExitStack() as stack:
+            index_path = index.path
+            if index_path is None or not os.path.isdir(index_path):
+                # Indexes that were never saved are written out once for the workers
+                index_path = stack.enter_context(tempfile.TemporaryDirectory())
+                save_index(index, index_path)
+            with process_pool(
+                n_process, initializer=_init_worker, initargs=(index_path,)
+            ) as executor:
+                for chunk in executor.map(_search_chunk, chunks):
+                    results.extend(chunk)
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Precomputed BM25 candidates for {len(items)} queries in {elapsed:.1f}s "
+        f"({len(items) / max(elapsed, 1e-9):.0f} queries/s, {n_process} processes)"
+    )
+    return {
+        "format_version": CANDIDATES_FORMAT_VERSION,
+        "index": index_fingerprint(index),
+        "k": k,
+        "queries": {
+            query: {"ids": ids, "scores": scores}
+            for (query, _, _), (ids, scores) in zip(items, results)
+        },
+    }
+
+
+def save_candidates(candidates: dict[str, Any], path: str) -> None:
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(candidates, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved BM25 candidates to {path}")
+
+
+def load_candidates(path: str, index: BM25Index) -> dict[str, dict[str, list]]:
+    """
+    Returns the precomputed candidates per query from the sidecar at ``path``,
+    or an empty dict if there is none or it was computed for another corpus.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            candidates = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Could not read BM25 candidates from {path}: {e}")
+        return {}
+    if (
+        candidates.get("format_version") != CANDIDATES_FORMAT_VERSION
+        or candidates.get("index") != index_fingerprint(index)
+    ):
+        logger.warning(f"BM25 candidates in {path} are stale, ignoring them")
+        return {}
+    logger.info(f"Loaded BM25 candidates for {len(candidates['queries'])} queries")
+    return candidates["queries"]
+
+
+def precompute_candidates_file(
+    data_file_path: str,
+    k: int = DEFAULT_CANDIDATES_K,
+    n_process: int | None = None,
+) -> str:
+    """Precomputes the candidates of an annotation file and writes its sidecar."""
+    with open(data_file_path, "r", encoding="utf-8") as f:
+        ground_truth = json.load(f)
+    index = get_or_build_index(ground_truth, source=data_file_path)
+    path = candidates_path(data_file_path)
+    save_candidates(precompute_candidates(ground_truth, index, k, n_process), path)
+    return path
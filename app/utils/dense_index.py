@@ -0,0 +1,202 @@
+import os
+import time
+import logging
+import numpy as np
+from typing import Any, Callable, Iterable
+from app.utils.bm25_handler import FUSION_DEPTH, RankedResults
+from app.utils.bm25_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+# Sidecar file with one embedding per entry of all_texts (data.json -> data.embeddings.npy)
+EMBEDDINGS_SUFFIX = ".embeddings.npy"
+# Vectors scored per matrix product, bounds the memory of a search
+DENSE_CHUNK_SIZE = 65536
+
+
+def embeddings_path(data_file_path: str) -> str:
+    """Returns the embeddings sidecar file next to an annotation file."""
+    root, _ = os.path.splitext(data_file_path)
+    return root + EMBEDDINGS_SUFFIX
+
+
+class DenseIndex:
+    """
+    Precomputed embedding vectors of the texts of a BM25 index, searched by
+    exact cosine similarity with chunked matrix-vector products.
+
+    ``vectors`` (rows x dimensions, possibly memory-mapped) are used as given;
+    ``positions`` maps every row to the position of its text in the BM25
+    index, or -1 for texts that are not (or no longer) in the index, so
+    results can be fused with BM25 rankings. Rows without a vector (all
+    zeros) never match.
+    """
+
+    def __init__(
+        self, vectors: np.ndarray, positions: np.ndarray, index: BM25Index
+    ) -> None:
+        if vectors.ndim != 2 or len(vectors) != len(positions):
+            raise ValueError(
+                f"Expected {len(positions)} embedding rows, got shape {vectors.shape}"
+            )
+        self.vectors = vectors
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.doc_ids = index.doc_ids
+        self.norms = np.concatenate(
+            [np.zeros(0, dtype=np.float32)]
+            + [
+                np.linalg.norm(
+                    np.asarray(vectors[start : start + DENSE_CHUNK_SIZE], dtype=np.float32),
+                    axis=1,
+                )
+                for start in range(0, len(vectors), DENSE_CHUNK_SIZE)
+            ]
+        )
+        # Row of every index position, -1 for positions without a vector
+        self.rows = np.full(index.corpus_size, -1, dtype=np.int64)
+        usable = np.flatnonzero((self.positions >= 0) & (self.norms > 0))
+        self.rows[self.positions[usable]] = usable
+
+    @classmethod
+    def from_embeddings(
+        cls, index: BM25Index, doc_ids: Iterable[Any], vectors: np.ndarray
+    ) -> "DenseIndex":
+        """Aligns the embeddings of the texts ``doc_ids`` with the live texts of ``index``."""
+        live_positions = {
+            doc_id: doc_index
+            for doc_index, doc_id in enumerate(index.doc_ids.tolist())
+            if not index.deleted[doc_index]
+        }
+        positions = np.fromiter(
+            (live_positions.get(doc_id, -1) for doc_id in doc_ids), dtype=np.int64
+        )
+        return cls(vectors, positions, index)
+
+    @property
+    def dimension(self) -> int:
+        return self.vectors.shape[1]
+
+    def __len__(self) -> int:
+        return int((self.rows >= 0).sum())
+
+    def query_vector(self, doc_indices: Iterable[int]) -> np.ndarray | None:
+        """
+        Returns the centroid of the unit vectors of the texts at ``doc_indices``,
+        or None if none of them has a vector.
+        """
+        rows = self.rows[np.fromiter(doc_indices, dtype=np.int64)]
+        rows = np.unique(rows[rows >= 0])
+        if not len(rows):
+            return None
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        return (vectors / self.norms[rows][:, None]).mean(axis=0)
+
+    def similarities(self, query_vector: np.ndarray) -> np.ndarray:
+        """
+        Returns the cosine similarity of every index position to
+        ``query_vector``, NaN for positions without a vector.
+        """
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        if len(query) != self.dimension:
+            raise ValueError(
+                f"Query vector has {len(query)} dimensions, expected {self.dimension}"
+            )
+        similarities = np.full(len(self.rows), np.nan, dtype=np.float32)
+        query_norm = float(np.linalg.norm(query))
+        if not query_norm:
+            return similarities
+
+        start = time.perf_counter()
+        scores = np.empty(len(self.vectors), dtype=np.float32)
+        for chunk in range(0, len(self.vectors), DENSE_CHUNK_SIZE):
+            vectors = np.asarray(
+                self.vectors[chunk : chunk + DENSE_CHUNK_SIZE], dtype=np.float32
+            )
+            scores[chunk : chunk + len(vectors)] = vectors @ query
+        present = self.rows >= 0
+        rows = self.rows[present]
+        similarities[present] = scores[rows] / (self.norms[rows] * query_norm)
+        logger.debug(
+            f"Scored {len(self.vectors)} embeddings in "
+            f"{(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+        return similarities
+
+    def rank(
+        self,
+        query_vector: np.ndarray,
+        exclude: Iterable[int] = (),
+        depth: int = FUSION_DEPTH,
+        clusters: np.ndarray | None = None,
+    ) -> RankedResults:
+        """
+        Ranks the ``depth`` texts most similar to ``query_vector`` by cosine
+        similarity, leaving out the index positions in ``exclude``. With
+        ``clusters``, near-duplicates are collapsed like in
+        ``BM25Searcher.rank``.
+        """
+        similarities = self.similarities(query_vector)
+        positions = np.flatnonzero(~np.isnan(similarities))
+        excluded = np.fromiter(exclude, dtype=np.int64)
+        if len(excluded):
+            positions = positions[~np.isin(positions, excluded)]
+        scores = similarities[positions]
+        if depth < len(positions):
+            best = np.argpartition(-scores, depth - 1)[:depth]
+            positions, scores = positions[best], scores[best]
+        ranking = RankedResults(positions, scores, self.doc_ids)
+        return ranking.collapse(clusters) if clusters is not None else ranking
+
+
+def similarity_ranking(similarities: np.ndarray, ranking: RankedResults) -> RankedResults:
+    """
+    Ranks the matches of ``ranking`` by their ``similarities`` (see
+    ``DenseIndex.similarities``), leaving out matches without a vector. Fusing
+    the result with ``ranking`` reorders its matches without adding any that
+    the query does not match.
+    """
+    scores = similarities[ranking.doc_indices]
+    present = ~np.isnan(scores)
+    return RankedResults(
+        ranking.doc_indices[present], scores[present], ranking.doc_ids
+    )
+
+
+def load_dense_index(
+    ground_truth: dict[str, Any],
+    data_file_path: str,
+    index: BM25Index,
+    progress: Callable[[str, int, int], None] | None = None,
+) -> DenseIndex | None:
+    """
+    Returns the dense index of the texts of ``ground_truth``, from the
+    embeddings sidecar file (memory-mapped, one row per entry of all_texts)
+    if it exists and from the ``embedding`` entries of all_texts otherwise.
+    Returns None if there are no embeddings.
+    """
+    all_texts = ground_truth.get("all_texts", [])
+    path = embeddings_path(data_file_path)
+    if os.path.exists(path):
+        if progress:
+            progress("Loading embeddings", 0, 0)
+        vectors = np.load(path, mmap_mode="r")
+        if vectors.ndim != 2 or len(vectors) != len(all_texts):
+            raise ValueError(
+                f"{path} holds {vectors.shape} embeddings, "
+                f"expected one row per text ({len(all_texts)})"
+            )
+        doc_ids = [item["id"] for item in all_texts]
+    else:
+        embedded = [item for item in all_texts if item.get("embedding")]
+        if not embedded:
+            return None
+        if progress:
+            progress("Loading embeddings", 0, 0)
+        doc_ids = [item["id"] for item in embedded]
+        vectors = np.asarray([item["embedding"] for item in embedded], dtype=np.float32)
+    dense_index = DenseIndex.from_embeddings(index, doc_ids, vectors)
+    logger.info(
+        f"Dense index ready ({len(dense_index)} embeddings, "
+        f"{dense_index.dimension} dimensions)"
+    )
+    return dense_index
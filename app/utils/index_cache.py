@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import shutil
+import logging
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Environment variables to override the cache location and size limit
+CACHE_DIR_ENV = "RAG_ANNOTATOR_CACHE_DIR"
+CACHE_MAX_BYTES_ENV = "RAG_ANNOTATOR_CACHE_MAX_BYTES"
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rag-annotator")
+DEFAULT_MAX_BYTES = 4 * 1024**3  # 4 GiB
+
+METADATA_FILE = "meta.json"
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class IndexCache:
+    """
+    Content-addressed on-disk cache for search indexes.
+
+    Each entry is a directory named after its key and format version, holding
+    the payload written by the caller plus a ``meta.json`` that records what
+    the entry was built from. An entry is only served if its metadata matches
+    the expected one; entries without metadata (interrupted writes) are
+    treated as stale and removed. The cache directory may be shared by
+    several versions of the tool: entries of other format versions are never
+    served but only evicted like any other entry. When the cache grows beyond
+    ``max_bytes``, the least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        format_version: int,
+        cache_dir: str | None = None,
+        max_bytes: int | None = None,
+    ) -> None:
+        self.format_version = format_version
+        self.cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(CACHE_MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+        self.max_bytes = max_bytes
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}-v{self.format_version}")
+
+    def _read_metadata(self, path: str) -> dict[str, Any] | None:
+        try:
+            with open(os.path.join(path, METADATA_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _remove(self, path: str) -> None:
+        logger.info(f"Removing index cache entry {path}")
+        shutil.rmtree(path, ignore_errors=True)
+
+    def lookup(self, key: str, metadata: dict[str, Any]) -> str | None:
+        """
+        Returns the directory of a valid entry for ``key``, or None.
+        Only the keys in ``metadata`` are compared, so entries may carry
+        additional information. A stale entry under that key is removed.
+        """
+        path = self.entry_path(key)
+        if not os.path.isdir(path):
+            return None
+        stored = self._read_metadata(path)
+        expected = {**metadata, "format_version": self.format_version}
+        if stored is None or any(stored.get(k) != v for k, v in expected.items()):
+            logger.warning(f"Index cache entry {path} is stale")
+            self._remove(path)
+            return None
+        # Bump the modification time so eviction treats the entry as recently used
+        os.utime(path)
+        return path
+
+    def entries(self) -> list[tuple[str, dict[str, Any]]]:
+        """Returns (directory, metadata) of all current entries, most recently used first."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(path) or ".tmp-" in name:
+                continue
+            stored = self._read_metadata(path)
+            if stored is not None and stored.get("format_version") == self.format_version:
+                entries.append((os.path.getmtime(path), path, stored))
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        return [(path, stored) for _, path, stored in entries]
+
+    def store(
+        self, key: str, metadata: dict[str, Any], write: Callable[[str], None]
+    ) -> str:
+        """
+        Creates the entry for ``key`` by calling ``write`` with a fresh directory.
+        The entry only becomes visible once it has been written completely.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.entry_path(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        try:
+            write(tmp_path)
+            stored = {
+                **metadata,
+                "format_version": self.format_version,
+                "created": time.time(),
+            }
+            with open(os.path.join(tmp_path, METADATA_FILE), "w", encoding="utf-8") as f:
+                json.dump(stored, f, indent=2)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+        return path
+
+    def evict(self, keep: str | None = None) -> None:
+        """
+        Removes entries without metadata, then the least recently used ones
+        (of any format version) until the cache is under ``max_bytes``.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        keep_path = self.entry_path(keep) if keep is not None else None
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(path) or ".tmp-" in name:
+                continue
+            if self._read_metadata(path) is None:
+                self._remove(path)
+                continue
+            entries.append((os.path.getmtime(path), _directory_size(path), name, path))
+
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, name, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            self._remove(path)
+            total -= size
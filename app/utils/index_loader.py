@@ -0,0 +1,73 @@
+import time
+import logging
+from typing import Any
+from PySide6.QtCore import QThread, Signal
+from app.utils.bm25_handler import get_or_build_index
+from app.utils.dense_index import load_dense_index
+
+logger = logging.getLogger(__name__)
+
+
+class IndexLoadInterrupted(Exception):
+    """Raised inside the worker thread when the index load was cancelled."""
+
+
+class IndexLoaderThread(QThread):
+    """
+    Builds or loads the BM25 index for a ground truth file off the GUI thread,
+    followed by the dense index of its embeddings if there are any.
+
+    ``progress`` carries the current stage, the processed and total number of
+    texts (0 and 0 while unknown) and the estimated remaining seconds of the
+    stage (-1 while unknown). Exactly one of ``index_ready`` and ``failed`` is
+    emitted unless the thread is interrupted. ``index_ready`` carries the BM25
+    index and the dense index, or None if it could not be loaded.
+    """
+
+    progress = Signal(str, int, int, float)
+    index_ready = Signal(object, object)
+    failed = Signal(str)
+
+    def __init__(self, ground_truth_data: dict[str, Any], source: str, parent=None):
+        super().__init__(parent)
+        self.ground_truth_data = ground_truth_data
+        self.source = source
+        self._stage = None
+        self._stage_start = 0.0
+
+    def _report_progress(self, stage: str, done: int, total: int) -> None:
+        if self.isInterruptionRequested():
+            raise IndexLoadInterrupted()
+        now = time.perf_counter()
+        if stage != self._stage:
+            self._stage = stage
+            self._stage_start = now
+        eta = -1.0
+        if 0 < done < total:
+            eta = (now - self._stage_start) / done * (total - done)
+        self.progress.emit(stage, done, total, eta)
+
+    def run(self) -> None:
+        try:
+            index = get_or_build_index(
+                self.ground_truth_data, source=self.source, progress=self._report_progress
+            )
+        except IndexLoadInterrupted:
+            logger.info("BM25 index loading interrupted")
+            return
+        except Exception as e:
+            logger.exception("Failed to build or load the BM25 index")
+            self.failed.emit(str(e))
+            return
+        try:
+            dense_index = load_dense_index(
+                self.ground_truth_data, self.source, index, self._report_progress
+            )
+        except IndexLoadInterrupted:
+            logger.info("Embedding loading interrupted")
+            return
+        except (OSError, ValueError, KeyError) as e:
+            # Lexical search still works without embeddings
+            logger.warning(f"Could not load the embeddings: {e}")
+            dense_index = None
+        self.index_ready.emit(index, dense_index)
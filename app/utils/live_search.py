@@ -0,0 +1,71 @@
+import logging
+import threading
+from typing import Iterable
+from PySide6.QtCore import QThread, Signal
+from app.utils.bm25_handler import BM25Searcher
+from app.utils.bm25_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+
+class LiveSearchThread(QThread):
+    """
+    Runs search-as-you-type queries off the GUI thread.
+
+    Only the newest request is kept: submitting a query replaces one that is
+    still waiting, and the results of a query that was superseded while it ran
+    are dropped. ``results_ready`` carries the generation passed to ``submit``,
+    so the caller can also ignore answers it no longer needs. The thread has
+    its own searcher (a plain ``BM25Searcher`` unless ``searcher`` is given),
+    as searchers must not be shared between threads.
+    """
+
+    results_ready = Signal(int, str, object)
+    failed = Signal(int, str)
+
+    def __init__(
+        self, index: BM25Index, parent=None, searcher: BM25Searcher | None = None
+    ):
+        super().__init__(parent)
+        self.searcher = searcher or BM25Searcher(
+            index, cache_size=0, ranking_cache_size=8
+        )
+        self._condition = threading.Condition()
+        self._pending = None
+        self._stopped = False
+
+    def submit(self, generation: int, query: str, exclude: Iterable[int] = ()) -> None:
+        """Queues ``query``, replacing any query that has not started yet."""
+        with self._condition:
+            self._pending = (generation, query, frozenset(exclude))
+            self._condition.notify()
+
+    def stop(self) -> None:
+        """Drops pending queries and waits for the running one to finish."""
+        with self._condition:
+            self._stopped = True
+            self._pending = None
+            self._condition.notify()
+        self.wait()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                generation, query, exclude = self._pending
+                self._pending = None
+
+            try:
+                ranking = self.searcher.rank(query, exclude, prefix=True, collapse=True)
+            except Exception as e:
+                logger.exception(f"Live search for {query!r} failed")
+                self.failed.emit(generation, str(e))
+                continue
+
+            with self._condition:
+                superseded = self._pending is not None or self._stopped
+            if not superseded:
+                self.results_ready.emit(generation, query, ranking)
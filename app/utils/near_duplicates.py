@@ -0,0 +1,176 @@
+import os
+import re
+import time
+import zlib
+import logging
+import numpy as np
+from typing import Callable, Sequence
+from app.utils.processes import process_pool
+
+logger = logging.getLogger(__name__)
+
+# MinHash signature length, split into LSH bands of NUM_PERMUTATIONS // LSH_BANDS
+# rows. 16 bands of 4 rows put texts of 0.7 Jaccard similarity into a common
+# bucket with a probability of 99%
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+# Texts are compared as sets of overlapping word n-grams
+SHINGLE_SIZE = 3
+# Estimated Jaccard similarity from which two texts count as near-duplicates
+DUPLICATE_THRESHOLD = 0.7
+# Texts per process pool task
+MINHASH_CHUNK_SIZE = 2000
+# Permutations evaluated at once, bounds the memory of a chunk
+PERMUTATION_BLOCK = 8
+
+WORD_PATTERN = re.compile(r"\w+")
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# Fixed seed, signatures must stay comparable across processes and builds
+_rng = np.random.default_rng(0x6D696E68)
+_PERMUTATION_A = _rng.integers(1, 1 << 32, NUM_PERMUTATIONS, dtype=np.uint64)
+_PERMUTATION_B = _rng.integers(0, 1 << 32, NUM_PERMUTATIONS, dtype=np.uint64)
+_BAND_MULTIPLIERS = _rng.integers(
+    1, 1 << 63, NUM_PERMUTATIONS // LSH_BANDS, dtype=np.uint64
+) | np.uint64(1)
+
+
+def _shingle_hashes(text: str, word_hashes: dict[str, int]) -> np.ndarray:
+    """Returns the 32-bit hashes of the word n-grams of ``text``."""
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    hashes = np.fromiter(
+        (
+            word_hashes[word]
+            if word in word_hashes
+            else word_hashes.setdefault(word, zlib.crc32(word.encode("utf-8")))
+            for word in words
+        ),
+        dtype=np.uint64,
+        count=len(words),
+    )
+    # Polynomial hash of every window, texts shorter than a shingle are one shingle
+    size = min(SHINGLE_SIZE, len(words))
+    shingles = np.zeros(len(words) - size + 1, dtype=np.uint64)
+    for offset in range(size):
+        shingles = shingles * _SHINGLE_MULTIPLIER + hashes[offset : len(shingles) + offset]
+    return (shingles ^ (shingles >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+
+
+def minhash_batch(texts: Sequence[str]) -> np.ndarray:
+    """
+    Returns the MinHash signatures (texts x NUM_PERMUTATIONS, uint32) of a batch
+    of texts. Texts without words get the same all-ones signature.
+    """
+    word_hashes: dict[str, int] = {}
+    shingles = [_shingle_hashes(text, word_hashes) for text in texts]
+    lengths = np.fromiter((len(s) for s in shingles), dtype=np.int64, count=len(texts))
+    signatures = np.full((len(texts), NUM_PERMUTATIONS), 0xFFFFFFFF, dtype=np.uint32)
+    present = np.flatnonzero(lengths)
+    if not len(present):
+        return signatures
+    flat = np.concatenate(shingles)
+    starts = (np.cumsum(lengths) - lengths)[present]
+    for block in range(0, NUM_PERMUTATIONS, PERMUTATION_BLOCK):
+        a = _PERMUTATION_A[block : block + PERMUTATION_BLOCK]
+        b = _PERMUTATION_B[block : block + PERMUTATION_BLOCK]
+        # Both factors are below 2**32, so the universal hash never overflows
+        values = (flat[:, None] * a + b) % _MERSENNE_PRIME
+        signatures[present, block : block + PERMUTATION_BLOCK] = np.minimum.reduceat(
+            values, starts, axis=0
+        ) & np.uint64(0xFFFFFFFF)
+    return signatures
+
+
+def minhash_texts(
+    texts: Sequence[str],
+    n_process: int | None = None,
+    progress: Callable[[str, int, int], None] | None = None,
+) -> np.ndarray:
+    """
+    Computes the MinHash signatures of many texts, in batches spread over a
+    process pool (all cores by default), reporting progress after every batch.
+    """
+    start = time.perf_counter()
+    chunks = [
+        texts[i : i + MINHASH_CHUNK_SIZE]
+        for i in range(0, len(texts), MINHASH_CHUNK_SIZE)
+    ]
+    n_process = max(1, min(n_process or os.cpu_count() or 1, len(chunks)))
+    signatures = [np.zeros((0, NUM_PERMUTATIONS), dtype=np.uint32)]
+    done = 0
+    if progress:
+        progress("Hashing texts for near-duplicates", 0, len(texts))
+    if n_process == 1:
+        for chunk in chunks:
+            signatures.append(minhash_batch(chunk))
+            done += len(chunk)
+            if progress:
+                progress("Hashing texts for near-duplicates", done, len(texts))
+    else:
+        executor = process_pool(n_process)
+        try:
+            futures = [executor.submit(minhash_batch, chunk) for chunk in chunks]
+            for future in futures:
+                signatures.append(future.result())
+                done += len(signatures[-1])
+                if progress:
+                    progress("Hashing texts for near-duplicates", done, len(texts))
+        finally:
+            executor.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Computed MinHash signatures of {len(texts)} texts in {elapsed:.1f}s "
+        f"({len(texts) / max(elapsed, 1e-9):.0f} docs/s, {n_process} processes)"
+    )
+    return np.concatenate(signatures)
+
+
+def cluster_signatures(signatures: np.ndarray, live: np.ndarray) -> np.ndarray:
+    """
+    Groups the live documents into near-duplicate clusters with LSH banding.
+
+    Documents sharing a band bucket are candidates; neighbours within a bucket
+    are linked if their signatures estimate a Jaccard similarity of at least
+    DUPLICATE_THRESHOLD, and linked documents form a cluster. Returns, for
+    every document, the position of its cluster's representative (the lowest
+    live position in the cluster; the document itself if it has no duplicate).
+    Sorting the band keys dominates, so this runs in O(n log n).
+    """
+    clusters = np.arange(len(signatures), dtype=np.int64)
+    positions = np.flatnonzero(live)
+    if len(positions) < 2:
+        return clusters
+    live_signatures = np.asarray(signatures[positions])
+    rows = NUM_PERMUTATIONS // LSH_BANDS
+
+    firsts, seconds = [], []
+    for band in range(LSH_BANDS):
+        band = live_signatures[:, band * rows : (band + 1) * rows]
+        keys = (band.astype(np.uint64) * _BAND_MULTIPLIERS).sum(axis=1)
+        order = np.argsort(keys, kind="stable")
+        same = keys[order[1:]] == keys[order[:-1]]
+        firsts.append(order[:-1][same])
+        seconds.append(order[1:][same])
+    first, second = np.concatenate(firsts), np.concatenate(seconds)
+    if len(first):
+        pairs = np.unique(first * len(positions) + second)
+        first, second = pairs // len(positions), pairs % len(positions)
+        similarity = (live_signatures[first] == live_signatures[second]).mean(axis=1)
+        linked = similarity >= DUPLICATE_THRESHOLD
+        first, second = first[linked], second[linked]
+
+    # Connected components by min-label propagation with pointer jumping
+    labels = np.arange(len(positions), dtype=np.int64)
+    while len(first):
+        smallest = np.minimum(labels[first], labels[second])
+        updated = labels.copy()
+        np.minimum.at(updated, first, smallest)
+        np.minimum.at(updated, second, smallest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    clusters[positions] = positions[labels]
+    return clusters
@@ -0,0 +1,16 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def process_pool(max_workers: int, **kwargs) -> ProcessPoolExecutor:
+    """
+    Creates a pool of ``max_workers`` worker processes, passing ``kwargs`` on
+    to ``ProcessPoolExecutor``. Workers are spawned rather than forked, as
+    index builds and searches may run in a thread of the GUI process, which
+    must not be forked.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        **kwargs,
+    )
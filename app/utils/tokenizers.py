@@ -0,0 +1,157 @@
+import re
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Sequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = "de"
+# Tokenization version marker, part of every fingerprint
+TOKEN_FORMAT = "lower-nospace"
+
+
+class Tokenizer(ABC):
+    """
+    Turns texts into lowercased index terms.
+
+    Backends are created through the registry and initialize lazily, so picking
+    a tokenizer (for example to compute a cache key) never loads a model.
+    """
+
+    name: str = ""
+
+    @abstractmethod
+    def fingerprint(self) -> str:
+        """Identifies the tokenization output; indexes built with another one are stale."""
+
+    @abstractmethod
+    def tokenize(self, text: str) -> list[str]:
+        """Returns the index terms of ``text``."""
+
+    def tokenize_batch(self, texts: Sequence[str]) -> list[list[str]]:
+        return [self.tokenize(text) for text in texts]
+
+
+class SpacyTokenizer(Tokenizer):
+    """Tokenizer of a trained spaCy pipeline; the pipeline components stay disabled."""
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, name: str, model: str) -> None:
+        self.name = name
+        self.model = model
+        self._nlp = None
+
+    def _create_nlp(self) -> Any:
+        import spacy
+
+        return spacy.load(self.model)
+
+    @property
+    def nlp(self) -> Any:
+        if self._nlp is None:
+            logger.info(f"Loading spaCy pipeline for tokenizer {self.name}")
+            self._nlp = self._create_nlp()
+        return self._nlp
+
+    def fingerprint(self) -> str:
+        import spacy
+        from spacy.util import get_package_version
+
+        version = get_package_version(self.model) or "unknown"
+        return f"spacy-{spacy.__version__}/{self.model}-{version}/{TOKEN_FORMAT}"
+
+    def tokenize(self, text: str) -> list[str]:
+        # Token texts come from the tokenizer alone, the trained pipeline is not needed
+        return [
+            token.text.lower() for token in self.nlp.make_doc(text) if not token.is_space
+        ]
+
+    def tokenize_batch(self, texts: Sequence[str]) -> list[list[str]]:
+        return [
+            [token.text.lower() for token in doc if not token.is_space]
+            for doc in self.nlp.pipe(
+                texts, batch_size=self.BATCH_SIZE, disable=self.nlp.pipe_names
+            )
+        ]
+
+
+class BlankSpacyTokenizer(SpacyTokenizer):
+    """Rule-based spaCy tokenizer of a blank language, no trained model required."""
+
+    def __init__(self, name: str, language: str) -> None:
+        super().__init__(name, model=f"blank:{language}")
+        self.language = language
+
+    def _create_nlp(self) -> Any:
+        import spacy
+
+        return spacy.blank(self.language)
+
+    def fingerprint(self) -> str:
+        import spacy
+
+        return f"spacy-{spacy.__version__}/blank-{self.language}/{TOKEN_FORMAT}"
+
+
+class RegexTokenizer(Tokenizer):
+    """Fast tokenizer splitting into word characters and single punctuation marks."""
+
+    PATTERN = r"\w+|[^\w\s]"
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._regex = re.compile(self.PATTERN)
+
+    def fingerprint(self) -> str:
+        return f"regex/{self.PATTERN}/{TOKEN_FORMAT}"
+
+    def tokenize(self, text: str) -> list[str]:
+        return self._regex.findall(text.lower())
+
+
+# Factories of the available tokenizers, keyed by the name used in input files
+TOKENIZER_FACTORIES: dict[str, Callable[[], Tokenizer]] = {
+    "spacy-de": lambda: SpacyTokenizer("spacy-de", "de_core_news_sm"),
+    "spacy-en": lambda: SpacyTokenizer("spacy-en", "en_core_web_sm"),
+    "regex": lambda: RegexTokenizer("regex"),
+}
+DEFAULT_TOKENIZER = f"spacy-{DEFAULT_LANGUAGE}"
+
+_instances: dict[str, Tokenizer] = {}
+
+
+def register_tokenizer(name: str, factory: Callable[[], Tokenizer]) -> None:
+    """Makes an additional tokenizer backend available under ``name``."""
+    TOKENIZER_FACTORIES[name] = factory
+    _instances.pop(name, None)
+
+
+def get_tokenizer(name: str = DEFAULT_TOKENIZER) -> Tokenizer:
+    """
+    Returns the (shared) tokenizer registered as ``name``. Besides the registered
+    names, ``blank-<lang>`` selects spaCy's rule-based tokenizer for any language.
+    """
+    tokenizer = _instances.get(name)
+    if tokenizer is None:
+        if name in TOKENIZER_FACTORIES:
+            tokenizer = TOKENIZER_FACTORIES[name]()
+        elif name.startswith("blank-"):
+            tokenizer = BlankSpacyTokenizer(name, name.removeprefix("blank-"))
+        else:
+            raise ValueError(f"Unknown tokenizer: {name}")
+        _instances[name] = tokenizer
+    return tokenizer
+
+
+def tokenizer_for(ground_truth: dict[str, Any]) -> str:
+    """
+    Picks the tokenizer for an input file: an explicit ``tokenizer`` field wins,
+    otherwise the trained spaCy pipeline for its ``language`` is used (falling
+    back to spaCy's rule-based tokenizer for languages without one).
+    """
+    if ground_truth.get("tokenizer"):
+        return ground_truth["tokenizer"]
+    language = ground_truth.get("language", DEFAULT_LANGUAGE)
+    name = f"spacy-{language}"
+    return name if name in TOKENIZER_FACTORIES else f"blank-{language}"
@@ -1,10 +1,22 @@
 import logging
 import re
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple, Sequence
+import numpy as np
 from PySide6.QtWidgets import QLayout
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
+from app.utils.formatting import format_md_text_to_html
 
 logger = logging.getLogger(__name__)
 
+# Window offsets per chunk searched at once by _find_best_phrase_match
+FUZZY_CHUNK_SIZE = 256
+# Bounds of the rendered text cache, in characters of HTML and in entries
+HIGHLIGHT_CACHE_CHARS = 32_000_000
+HIGHLIGHT_CACHE_ENTRIES = 4096
+
 
 def clear_layout(layout: QLayout | None) -> None:
     """
@@ -24,12 +36,33 @@ def clear_layout(layout: QLayout | None) -> None:
             # The layout item (representing the nested layout) is removed by takeAt(0)
 
 
-def _check_overlap(start: int, end: int, marked_ranges: list[tuple[int, int]]) -> bool:
-    """Check if a text range overlaps with any already marked ranges."""
-    for marked_start, marked_end in marked_ranges:
-        if not (end <= marked_start or start >= marked_end):
-            return True
-    return False
+class _IntervalIndex:
+    """
+    Static interval index over marked ranges for overlap queries in
+    O(log n): ranges sorted by start, plus the running maximum of their ends.
+    A query range overlaps a marked one iff among the ranges starting before
+    its end, the furthest-reaching one ends after its start.
+    """
+
+    def __init__(self, ranges: list[tuple[int, int]]) -> None:
+        ranges = sorted(ranges)
+        self.starts = [start for start, _ in ranges]
+        self.max_ends = np.maximum.accumulate(
+            np.array([end for _, end in ranges], dtype=np.int64)
+        ).tolist()
+
+    def overlaps(self, start: int, end: int) -> bool:
+        """Check if a text range overlaps with any of the marked ranges."""
+        count = bisect_left(self.starts, end)
+        return count > 0 and self.max_ends[count - 1] > start
+
+
+class HighlightSpan(NamedTuple):
+    """A highlighted range ``text[start:end]`` with its background colour."""
+
+    start: int
+    end: int
+    color: str
 
 
 def _create_highlight_span(text: str, color: str) -> str:
@@ -42,28 +75,48 @@ def _calculate_similarity(text1: str, text2: str) -> float:
     return fuzz.ratio(text1, text2) / 100.0
 
 
-def _apply_exact_highlighting(
-    text: str, keyword: str, color: str, marked_ranges: list[tuple[int, int]]
-) -> tuple[str, bool]:
-    """Apply exact word-boundary matching for a keyword."""
-    pattern = rf"(\b{re.escape(keyword)}\b)"
-    exact_matches = list(re.finditer(pattern, text, flags=re.IGNORECASE))
+@lru_cache(maxsize=64)
+def _keyword_pattern(keywords: tuple[str, ...]) -> re.Pattern:
+    """
+    Compiles one case-insensitive alternation of whole-word ``keywords``.
+    Longer keywords are tried first, so at every position the longest keyword
+    that matches wins and matches never overlap (leftmost-longest).
+    """
+    alternatives = sorted(keywords, key=len, reverse=True)
+    return re.compile(
+        rf"\b(?:{'|'.join(map(re.escape, alternatives))})\b", flags=re.IGNORECASE
+    )
 
-    if not exact_matches:
-        return text, False
 
-    result = text
-    for match in reversed(exact_matches):  # Process right-to-left to preserve offsets
+def _find_exact_spans(
+    text: str, keywords: tuple[str, ...], marked_ranges: list[tuple[int, int]]
+) -> tuple[list[tuple[int, int]], list[str]]:
+    """
+    Find exact word-boundary matches of all keywords in a single pass, leaving
+    out matches that overlap a marked range. Returns the spans and the
+    matched strings, including those of the left-out matches.
+    """
+    marked = _IntervalIndex(marked_ranges)
+    spans, matched = [], []
+    for match in _keyword_pattern(keywords).finditer(text):
         start, end = match.span()
-        if _check_overlap(start, end, marked_ranges):
-            continue
+        if not marked.overlaps(start, end):
+            spans.append((start, end))
+        matched.append(match.group(0))
+    return spans, matched
 
-        matched_text = match.group(1)
-        replacement = _create_highlight_span(matched_text, color)
-        result = result[:start] + replacement + result[end:]
-        marked_ranges.append((start, start + len(replacement)))
 
-    return result, True
+def _is_matched_exactly(text: str, keyword: str, matched: list[str]) -> bool:
+    """
+    Whether ``text`` contains an exact match of a keyword, highlighted or
+    not. The matched strings are checked first, as the keyword was usually
+    matched itself or as part of a longer keyword; a keyword whose matches
+    overlap those of a longer keyword is searched in the text.
+    """
+    pattern = _keyword_pattern((keyword.lower(),))
+    return any(pattern.search(matched_text) for matched_text in matched) or bool(
+        pattern.search(text)
+    )
 
 
 def _find_best_phrase_match(
@@ -72,41 +125,78 @@ def _find_best_phrase_match(
     min_score: float,
     marked_ranges: list[tuple[int, int]],
 ) -> tuple[int, int] | None:
-    """Find the best matching phrase using sliding window approach."""
+    """
+    Find the best matching phrase using sliding window approach: the first
+    window of the keyword's length with the highest similarity that does not
+    overlap a marked range.
+
+    Window offsets are split into chunks. ``fuzz.partial_ratio`` of a chunk
+    is the best similarity of any window in it, which bounds the scores of
+    its windows. Chunks are searched by descending bound until no remaining
+    chunk can hold a better (or equally good but earlier) window, scoring
+    the windows of a chunk in one rapidfuzz call.
+    """
     text_lower = text.lower()
     window_length = len(keyword_normalized)
-
-    best_span = None
-    best_score = -1.0
-
-    for i in range(len(text_lower) - window_length + 1):
-        start, end = i, i + window_length
-
-        if _check_overlap(start, end, marked_ranges):
+    num_windows = len(text_lower) - window_length + 1
+    if num_windows <= 0:
+        return None
+
+    chunk_starts = range(0, num_windows, FUZZY_CHUNK_SIZE)
+    bounds = process.cdist(
+        [keyword_normalized],
+        [
+            text_lower[start : start + FUZZY_CHUNK_SIZE + window_length - 1]
+            for start in chunk_starts
+        ],
+        scorer=fuzz.partial_ratio,
+        dtype=np.float64,
+    )[0] / 100.0
+
+    marked = _IntervalIndex(marked_ranges)
+    best_score, best_span = min_score, None
+    for chunk in np.argsort(-bounds, kind="stable").tolist():
+        # The tolerance guards against rounding differences between the scorers
+        if bounds[chunk] + 1e-9 < best_score:
+            break
+        chunk_start = chunk_starts[chunk]
+        if (
+            best_span
+            and chunk_start > best_span[0]
+            and bounds[chunk] <= best_score + 1e-9
+        ):
             continue
 
-        window_text = text_lower[start:end]
-        score = _calculate_similarity(keyword_normalized, window_text)
-
-        if score >= min_score and score > best_score:
-            best_score = score
-            best_span = (start, end)
-
-            if score == 1.0:  # Perfect match found
+        offsets = range(chunk_start, min(chunk_start + FUZZY_CHUNK_SIZE, num_windows))
+        scores = process.cdist(
+            [keyword_normalized],
+            [text_lower[i : i + window_length] for i in offsets],
+            scorer=fuzz.ratio,
+            dtype=np.float64,
+        )[0] / 100.0
+        # Windows by descending score, ties in text order
+        for index in np.argsort(-scores, kind="stable").tolist():
+            score, start = scores[index], offsets[index]
+            if score < best_score:
+                break
+            if best_span and score == best_score and start > best_span[0]:
+                break
+            if not marked.overlaps(start, start + window_length):
+                best_score, best_span = score, (start, start + window_length)
                 break
 
     return best_span
 
 
-def _apply_sentence_fuzzy_matching(
+def _find_sentence_match(
     text: str,
     keyword_normalized: str,
-    color: str,
     min_score: float,
     marked_ranges: list[tuple[int, int]],
-) -> tuple[str, bool]:
-    """Apply fuzzy matching for sentence-length keywords."""
+) -> tuple[int, int] | None:
+    """Find the first sentence similar enough to a sentence-length keyword."""
     sentence_pattern = r"[^.!?]+[.!?]?"
+    marked = _IntervalIndex(marked_ranges)
 
     for sentence_match in re.finditer(sentence_pattern, text):
         sentence = sentence_match.group(0)
@@ -117,62 +207,121 @@ def _apply_sentence_fuzzy_matching(
         if sentence_similarity >= min_score:
             start, end = sentence_match.span()
 
-            if _check_overlap(start, end, marked_ranges):
+            if marked.overlaps(start, end):
                 continue
 
-            replacement = _create_highlight_span(sentence, color)
-            result = text[:start] + replacement + text[end:]
-            marked_ranges.append((start, start + len(replacement)))
-            return result, True
-
-    return text, False
-
+            return start, end
 
-def _apply_phrase_fuzzy_matching(
-    text: str,
-    keyword_normalized: str,
-    color: str,
-    min_score: float,
-    marked_ranges: list[tuple[int, int]],
-) -> tuple[str, bool]:
-    """Apply fuzzy matching for short phrases using sliding window."""
-    best_span = _find_best_phrase_match(
-        text, keyword_normalized, min_score, marked_ranges
-    )
-
-    if best_span:
-        start, end = best_span
-        matched_text = text[start:end]
-        replacement = _create_highlight_span(matched_text, color)
-        result = text[:start] + replacement + text[end:]
-        marked_ranges.append((start, start + len(replacement)))
-        return result, True
-
-    return text, False
+    return None
 
 
-def _apply_fuzzy_highlighting(
+def _find_fuzzy_span(
     text: str,
     keyword: str,
-    color: str,
     min_score: float,
     marked_ranges: list[tuple[int, int]],
-) -> tuple[str, bool]:
-    """Apply fuzzy matching for a keyword (sentence or phrase mode)."""
+) -> tuple[int, int] | None:
+    """Find the fuzzy match of a keyword (sentence or phrase mode), if any."""
     keyword_normalized = keyword.lower().strip()
     word_count = len(keyword_normalized.split())
 
     # Use sentence mode for longer keywords (6+ words)
     if word_count >= 6:
-        return _apply_sentence_fuzzy_matching(
-            text, keyword_normalized, color, min_score, marked_ranges
-        )
+        return _find_sentence_match(text, keyword_normalized, min_score, marked_ranges)
     else:
-        return _apply_phrase_fuzzy_matching(
-            text, keyword_normalized, color, min_score, marked_ranges
+        return _find_best_phrase_match(
+            text, keyword_normalized, min_score, marked_ranges
         )
 
 
+def find_highlight_spans(
+    text: str,
+    keyword_groups: Sequence[tuple[Sequence[str], str]],
+    *,
+    exclude: Sequence[HighlightSpan] = (),
+    min_score: float = 0.7,  # 0-1 Levenshtein similarity needed for a fuzzy match
+    enable_fuzzy: bool = True,
+) -> list[HighlightSpan]:
+    """
+    Computes the highlighted ranges of ``text`` for groups of (keywords,
+    colour), e.g. item highlights followed by point keywords. Groups are
+    matched in order against the original text, and no span overlaps a span
+    of an earlier group or keyword, or one of the spans in ``exclude``.
+    Returns the spans sorted by position.
+
+    1. **Exact layer** – one cached whole-word alternation regex over all
+       keywords of a group, matched in a single pass. Where keywords overlap,
+       the leftmost match wins, and of those the longest.
+    2. **Fuzzy layer** – only runs if the text contains no exact match of
+       that keyword, not even one left out for overlapping an earlier span,
+       *and* `enable_fuzzy` is True.
+         - Single words / short phrases -> sliding-window substring search
+         - Longer sentences (≥ 6 words)  -> sentence-by-sentence similarity
+    """
+    marked_ranges = [(span.start, span.end) for span in exclude]
+    spans: list[HighlightSpan] = []
+
+    for keywords, color in keyword_groups:
+        distinct = tuple(sorted({keyword.lower() for keyword in keywords if keyword}))
+        if not distinct:
+            continue
+
+        # Exact matching of all keywords of the group first
+        exact_spans, matched = _find_exact_spans(text, distinct, marked_ranges)
+        marked_ranges.extend(exact_spans)
+        spans.extend(HighlightSpan(start, end, color) for start, end in exact_spans)
+
+        if not enable_fuzzy:
+            continue
+
+        # Fall back to fuzzy matching for keywords without an exact match
+        for keyword in keywords:
+            if not keyword or _is_matched_exactly(text, keyword, matched):
+                continue
+            span = _find_fuzzy_span(text, keyword, min_score, marked_ranges)
+            if span:
+                marked_ranges.append(span)
+                spans.append(HighlightSpan(*span, color))
+
+    spans.sort()
+    return spans
+
+
+def merge_highlight_spans(*span_lists: Sequence[HighlightSpan]) -> list[HighlightSpan]:
+    """
+    Combines lists of non-overlapping spans into one sorted list. Where spans
+    of different lists overlap, the span of the earlier list is kept.
+    """
+    merged: list[HighlightSpan] = []
+    for spans in span_lists:
+        marked = _IntervalIndex([(span.start, span.end) for span in merged])
+        merged.extend(span for span in spans if not marked.overlaps(span.start, span.end))
+    merged.sort()
+    return merged
+
+
+def render_highlights(text: str, spans: Sequence[HighlightSpan]) -> str:
+    """Wraps the (sorted, non-overlapping) spans of ``text`` in highlight tags."""
+    parts = []
+    last_end = 0
+    for start, end, color in spans:
+        parts.append(text[last_end:start])
+        parts.append(_create_highlight_span(text[start:end], color))
+        last_end = end
+    parts.append(text[last_end:])
+    return "".join(parts)
+
+
+def highlight_keyword_groups(
+    text: str, keyword_groups: Sequence[tuple[Sequence[str], str]], **options
+) -> str:
+    """
+    Highlights groups of (keywords, colour) in ``text`` with a single render
+    pass, see ``find_highlight_spans`` for the matching and its ``options``.
+    """
+    return render_highlights(text, find_highlight_spans(text, keyword_groups, **options))
+
+
 def highlight_keywords(
     text: str,
     keywords: list[str],
@@ -184,12 +333,6 @@ def highlight_keywords(
     """
     Highlight exact or approximately-matching keywords/phrases/sentences.
 
-    1. **Exact layer** – uses the original whole-word regex you wrote.
-    2. **Fuzzy layer** – only runs if the exact layer found nothing for that
-       keyword *and* `enable_fuzzy` is True.
-         - Single words / short phrases -> sliding-window substring search
-         - Longer sentences (≥ 6 words)  -> sentence-by-sentence similarity
-
     Parameters
     ----------
     text : str
@@ -198,33 +341,123 @@ def highlight_keywords(
         Words, phrases, or whole sentences you’d like to flag.
     color : str
         Any valid CSS colour – '#ff0', 'rgba(255,0,0,.25)', …
-    min_score : float, default 0.85
+    min_score : float, default 0.7
         Minimum similarity (0-1) for the fuzzy layer to accept a match.
     enable_fuzzy : bool, default True
         Turn fuzzy matching on/off globally.
     """
-    if not keywords:
-        return text
-
-    result = text
-    marked_ranges: list[tuple[int, int]] = []
+    return highlight_keyword_groups(
+        text, [(keywords, color)], min_score=min_score, enable_fuzzy=enable_fuzzy
+    )
 
-    for keyword in keywords:
-        if not keyword:
-            continue
 
-        # Try exact matching first
-        result, found_exact = _apply_exact_highlighting(
-            result, keyword, color, marked_ranges
-        )
-
-        if found_exact:
-            continue
+class HighlightCache:
+    """
+    Bounded LRU caches of highlight spans and of highlighted texts rendered to
+    HTML (highlighting plus ``format_md_text_to_html``), shared by all panels.
+
+    Spans are keyed by the text, the keyword set and colour of every group,
+    the excluded spans and the matching options; keyword order within a group
+    does not matter. Rendered HTML is keyed by the text and its spans. Keys
+    hold references to the texts, which the data model holds anyway, so the
+    HTML cache is bounded by the characters of the HTML it keeps
+    (``max_chars``); both caches keep at most ``max_entries`` entries.
+    ``hits``/``misses`` (HTML) and ``span_hits``/``span_misses`` count the
+    lookups since creation or the last ``clear``.
+    """
 
-        # Fall back to fuzzy matching if enabled
-        if enable_fuzzy:
-            result, _ = _apply_fuzzy_highlighting(
-                result, keyword, color, min_score, marked_ranges
+    def __init__(
+        self,
+        max_chars: int = HIGHLIGHT_CACHE_CHARS,
+        max_entries: int = HIGHLIGHT_CACHE_ENTRIES,
+    ) -> None:
+        self.max_chars = max_chars
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self.span_hits = self.span_misses = 0
+        self._chars = 0
+        self._entries: OrderedDict[tuple, str] = OrderedDict()
+        self._spans: OrderedDict[tuple, tuple[HighlightSpan, ...]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """Characters of rendered HTML held by the cache."""
+        return self._chars
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._spans.clear()
+        self._chars = 0
+        self.hits = self.misses = 0
+        self.span_hits = self.span_misses = 0
+
+    def spans(
+        self,
+        text: str,
+        keyword_groups: Sequence[tuple[Sequence[str], str]],
+        *,
+        exclude: Sequence[HighlightSpan] = (),
+        min_score: float = 0.7,
+        enable_fuzzy: bool = True,
+    ) -> tuple[HighlightSpan, ...]:
+        """Returns the spans of ``keyword_groups`` in ``text``, see ``find_highlight_spans``."""
+        groups = [
+            (tuple(sorted(set(keywords))), color) for keywords, color in keyword_groups
+        ]
+        key = (text, tuple(groups), tuple(exclude), min_score, enable_fuzzy)
+        spans = self._spans.get(key)
+        if spans is not None:
+            self._spans.move_to_end(key)
+            self.span_hits += 1
+            return spans
+
+        self.span_misses += 1
+        spans = tuple(
+            find_highlight_spans(
+                text,
+                groups,
+                exclude=exclude,
+                min_score=min_score,
+                enable_fuzzy=enable_fuzzy,
             )
-
-    return result
+        )
+        self._spans[key] = spans
+        if len(self._spans) > self.max_entries:
+            self._spans.popitem(last=False)
+        return spans
+
+    def render_spans(self, text: str, spans: Sequence[HighlightSpan]) -> str:
+        """Returns the HTML of ``text`` with the (sorted, non-overlapping) ``spans`` highlighted."""
+        key = (text, tuple(spans))
+        html = self._entries.get(key)
+        if html is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+        self.misses += 1
+        html = format_md_text_to_html(render_highlights(text, spans))
+        if len(html) <= self.max_chars:
+            self._entries[key] = html
+            self._chars += len(html)
+            while self._chars > self.max_chars or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= len(evicted)
+        return html
+
+    def render(
+        self,
+        text: str,
+        keyword_groups: Sequence[tuple[Sequence[str], str]],
+        **options,
+    ) -> str:
+        """Returns the HTML of ``text`` with ``keyword_groups`` highlighted."""
+        return self.render_spans(text, self.spans(text, keyword_groups, **options))
@@ -1,4 +1,5 @@
 import os
+import re
 import logging
 from PySide6.QtWidgets import (
     QWidget,
@@ -10,13 +11,18 @@ from app.widgets.top_panel import TopPanel
 from app.widgets.left_panel import LeftPanel
 from app.widgets.right_panel import RightPanel
 from app.widgets.bottom_panel import BottomPanel
-from app.utils.ui_helpers import highlight_keywords
+from app.utils.ui_helpers import HighlightCache, merge_highlight_spans
 from app.utils.data_handler import save_ground_truth
 from app.utils.bm25_handler import (
-    get_or_build_index,
-    extract_texts_from_ground_truth,
+    BM25Searcher,
+    RankedResults,
+    ShardedSearcher,
+    reciprocal_rank_fusion,
 )
-from app.utils.formatting import format_md_text_to_html
+from app.utils.candidates import candidates_path, load_candidates, point_query
+from app.utils.dense_index import similarity_ranking
+from app.utils.index_loader import IndexLoaderThread
+from app.utils.live_search import LiveSearchThread
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +32,8 @@ class AnnotationApp(QWidget):
     ITEM_HIGHLIGHT_COLOR = (
         "rgba(135, 206, 250, 0.3)"  # Light blue for item-specific highlights
     )
+    # Number of BM25 results shown in the right panel per page
+    BM25_PAGE_SIZE = 20
 
     def __init__(self, data_file_path, ground_truth_data):
         super().__init__()
@@ -39,18 +47,43 @@ class AnnotationApp(QWidget):
         self.setGeometry(100, 100, 1400, 900)
 
         # --- BM25 Setup ---
-        # Generate a unique base name for the pickle file from the JSON filename
-        pickle_base_name = os.path.splitext(os.path.basename(self.data_file_path))[0]
-        pickle_path = f"bm25_index_{pickle_base_name}.pkl"
-        logger.info(f"Using BM25 index file: {pickle_path}")
-        self.bm25_index = get_or_build_index(self.ground_truth_data, pickle_path)
-
-        # Create a map for quick text-to-ID lookup
-        self.text_to_id_map = {
-            item["text"]: item["id"]
-            for item in self.ground_truth_data.get("all_texts", [])
-        }
-        self.bm25_texts = extract_texts_from_ground_truth(self.ground_truth_data)
+        # The index is built or loaded in the background (see _start_index_loader),
+        # search stays disabled until it is ready
+        self.bm25_index = None
+        self.bm25_searcher = None
+        self.bm25_texts = []
+        self.id_to_doc_index = {}
+        # Precomputed BM25 results per point query (see app/utils/candidates.py)
+        self.bm25_candidates = {}
+        # Embeddings of the texts, if the input has any (see app/utils/dense_index.py)
+        self.dense_index = None
+        # Ranking shown in the right panel, further pages are loaded on scroll
+        self.bm25_results = None
+        self.bm25_results_shown = 0
+        self.bm25_results_query = ""
+        self.bm25_results_keywords = []
+        self.bm25_results_score_kind = "bm25"
+        # Unfused ranking, query, keywords and message of the search shown in
+        # the right panel, so toggling hybrid search can redo or undo the fusion
+        self.search_view = None
+        # Embedding similarities of all texts to the current point with the key
+        # they were computed for (see _dense_similarities), reused for every
+        # search of the point
+        self.dense_similarities = None
+        self.index_loader = None
+        # Search-as-you-type runs in its own thread, only the results of the
+        # latest request (generation) are shown
+        self.live_search = None
+        self.live_search_generation = 0
+        # Rendered HTML of highlighted texts, shared by the left and right panel
+        self.highlight_cache = HighlightCache()
+        # Fetched texts of the current point by ID, with the spans of their
+        # highlights and point keywords and, per temporary keyword selected in
+        # the description, the spans of that keyword (see _on_temp_keywords_changed)
+        self.fetched_items = {}
+        self.fetched_spans = {}
+        self.fetched_temp_spans = {}
+        self.temp_keywords = []
 
         # --- Main Layout ---
         self.main_layout = QVBoxLayout(self)
@@ -82,6 +115,8 @@ class AnnotationApp(QWidget):
             self.bottom_panel.set_next_enabled(False)
             self.bottom_panel.set_confirm_text("Confirm")
 
+        self._start_index_loader()
+
     def _init_panels(self):
         """Initialize all panels and connect their signals."""
         # Top Panel
@@ -103,7 +138,14 @@ class AnnotationApp(QWidget):
         # Right Panel
         self.right_panel = RightPanel()
         self.right_panel.search_requested.connect(self.perform_bm25_search)
+        self.right_panel.live_search_requested.connect(self._on_live_search_requested)
+        self.right_panel.item_expand_clicked.connect(self._expand_near_duplicates)
+        self.right_panel.more_like_selected_requested.connect(
+            self.perform_more_like_selected_search
+        )
         self.right_panel.item_add_clicked.connect(self.add_bm25_result_to_fetched)
+        self.right_panel.more_results_requested.connect(self._load_more_bm25_results)
+        self.right_panel.hybrid_toggled.connect(self._on_hybrid_toggled)
         self.splitter.addWidget(self.right_panel)
         
         self.main_layout.addWidget(self.splitter, 1)
@@ -116,6 +158,88 @@ class AnnotationApp(QWidget):
         self.bottom_panel.next_clicked.connect(self.navigate_next)
         self.main_layout.addWidget(self.bottom_panel)
 
+    def _start_index_loader(self):
+        """
+        Builds or loads the BM25 index in a worker thread. The index is cached by
+        corpus content, so edits to all_texts trigger a (incremental) update of
+        the previous index built for this file.
+        """
+        self.right_panel.set_search_enabled(False)
+        self.right_panel.set_index_progress("Preparing BM25 index", 0, 0, -1)
+        self.index_loader = IndexLoaderThread(
+            self.ground_truth_data, self.data_file_path, self
+        )
+        self.index_loader.progress.connect(self.right_panel.set_index_progress)
+        self.index_loader.index_ready.connect(self._on_index_ready)
+        self.index_loader.failed.connect(self._on_index_failed)
+        self.index_loader.start()
+
+    @Slot(object, object)
+    def _on_index_ready(self, index, dense_index):
+        """Installs the loaded BM25 (and dense) index and enables the search panel."""
+        self.bm25_index = index
+        self.dense_index = dense_index
+        self.dense_similarities = None
+        live_searcher = None
+        if index.shards_path is not None:
+            # Large indexes are scored by worker processes, one task per shard
+            self.bm25_searcher = ShardedSearcher(index)
+            live_searcher = ShardedSearcher(
+                index,
+                cache_size=0,
+                ranking_cache_size=8,
+                executor=self.bm25_searcher.executor,
+            )
+        else:
+            self.bm25_searcher = BM25Searcher(index)
+        self.live_search = LiveSearchThread(index, self, live_searcher)
+        self.live_search.results_ready.connect(self._on_live_search_results)
+        self.live_search.start()
+
+        # Index positions need not follow all_texts after incremental updates,
+        # so align texts and ID lookups with the index's document positions
+        text_by_id = {
+            item["id"]: item["text"]
+            for item in self.ground_truth_data.get("all_texts", [])
+        }
+        doc_ids = index.doc_ids.tolist()
+        self.bm25_texts = [text_by_id.get(doc_id, "") for doc_id in doc_ids]
+        # Map IDs to index positions so fetched texts can be excluded from searches
+        self.id_to_doc_index = {
+            doc_id: doc_index
+            for doc_index, doc_id in enumerate(doc_ids)
+            if not index.deleted[doc_index]
+        }
+
+        self.bm25_candidates = load_candidates(
+            candidates_path(self.data_file_path), index
+        )
+
+        logger.info(f"BM25 index ready ({index.num_live_docs} texts)")
+        self.right_panel.set_index_status(None)
+        self.right_panel.set_search_enabled(True)
+        self.right_panel.set_hybrid_available(dense_index is not None)
+        if self.current_point_index is not None and self.ground_truth_data["points"]:
+            self._show_precomputed_candidates(
+                self.ground_truth_data["points"][self.current_point_index]
+            )
+
+    @Slot(str)
+    def _on_index_failed(self, error):
+        """Keeps the search panel disabled and shows why."""
+        self.right_panel.set_index_status(f"BM25 index could not be loaded: {error}")
+
+    def closeEvent(self, event):
+        """Stops a running index build, live search and search workers before the window closes."""
+        if self.index_loader is not None and self.index_loader.isRunning():
+            self.index_loader.requestInterruption()
+            self.index_loader.wait()
+        if self.live_search is not None:
+            self.live_search.stop()
+        if isinstance(self.bm25_searcher, ShardedSearcher):
+            self.bm25_searcher.close()
+        super().closeEvent(event)
+
     def _apply_stylesheet(self):
         """Loads and applies the stylesheet from an external CSS file."""
         try:
@@ -161,6 +285,9 @@ class AnnotationApp(QWidget):
         # --- Clear existing UI elements ---
         self.left_panel.clear()
         self.right_panel.clear()
+        self.bm25_results = None
+        self.search_view = None
+        self.live_search_generation += 1
         self.right_panel.set_search_text("")
 
         # Scroll both panels to the top
@@ -191,40 +318,28 @@ class AnnotationApp(QWidget):
 
         # --- Populate Left Panel (Fetched Texts) ---
         is_evaluated = point_data.get("evaluated", False)
-        point_keywords = point_data.get("keywords", [])
+        selected_ids = {
+            sel_item.get("id") for sel_item in point_data.get("selected_texts", [])
+        }
+        self.fetched_items = {}
+        self.fetched_spans = {}
+        self.fetched_temp_spans = {}
+        # The description starts with only the point keywords selected
+        self.temp_keywords = []
 
         for item_data in point_data.get("fetched_texts", []):
             item_id = item_data.get("id")
-            text = item_data.get("text", "")
             source = item_data.get("source", "unknown")
             metadata = item_data.get("metadata", {})
-            item_specific_highlights = item_data.get("highlights", [])
 
             if item_id is None:
                 logger.warning("Found fetched_text item without an ID. Skipping.")
                 continue
 
-            temp_highlighted_text = text  # Start with original text
-            if item_specific_highlights:
-                temp_highlighted_text = highlight_keywords(
-                    temp_highlighted_text,
-                    item_specific_highlights,
-                    self.ITEM_HIGHLIGHT_COLOR,
-                )
-
-            if point_keywords:
-                temp_highlighted_text = highlight_keywords(
-                    temp_highlighted_text, point_keywords, self.HIGHLIGHT_COLOR
-                )
-
-            highlighted_text = temp_highlighted_text
-            formatted_text = format_md_text_to_html(highlighted_text)
+            formatted_text = self._highlight_fetched_text(item_data, point_data)
 
             # Check if this item is selected
-            is_selected = any(
-                sel_item.get("id") == item_id
-                for sel_item in point_data.get("selected_texts", [])
-            )
+            is_selected = item_id in selected_ids
 
             # Add item to the left panel
             item_widget = self.left_panel.add_item(
@@ -235,6 +350,13 @@ class AnnotationApp(QWidget):
             if item_widget:
                 item_widget.set_selected(is_selected)
 
+        cache = self.highlight_cache
+        logger.debug(
+            f"Highlight cache: {cache.hits} hits, {cache.misses} misses "
+            f"({cache.hit_rate:.0%}), {len(cache)} texts, {cache.size} chars; "
+            f"spans: {cache.span_hits} hits, {cache.span_misses} misses"
+        )
+
         # --- Update Button States ---
         self.bottom_panel.set_prev_enabled(point_index > 0)
         self.bottom_panel.set_next_enabled(
@@ -246,6 +368,36 @@ class AnnotationApp(QWidget):
         # --- Disable/Enable Left Panel Items based on evaluation status ---
         self.left_panel.set_enabled(not is_evaluated)
 
+        # --- Populate Right Panel with precomputed BM25 results ---
+        self._show_precomputed_candidates(point_data)
+
+    def _show_precomputed_candidates(self, point_data):
+        """Shows the precomputed BM25 results of the point's default query, if any."""
+        query = point_query(point_data)
+        candidates = self.bm25_candidates.get(query)
+        if not candidates:
+            return
+
+        # Texts fetched after the candidates were computed are left out as well
+        used_ids = {item.get("id") for item in point_data.get("fetched_texts", [])}
+        kept = [
+            (self.id_to_doc_index[doc_id], score)
+            for doc_id, score in zip(candidates["ids"], candidates["scores"])
+            if doc_id not in used_ids and doc_id in self.id_to_doc_index
+        ]
+        if not kept:
+            return
+        doc_indices, scores = zip(*kept)
+        ranking = RankedResults(doc_indices, scores, self.bm25_index.doc_ids)
+        if self.bm25_index.clusters is not None:
+            ranking = ranking.collapse(self.bm25_index.clusters)
+        self._show_search_ranking(
+            ranking,
+            query,
+            point_data.get("keywords", []),
+            message="Precomputed results for the point description",
+        )
+
     def _remove_point(self):
         """Removes the current evaluation point from the ground truth without confirmation"""
         if self.current_point_index is None or not self.ground_truth_data["points"]:
@@ -356,43 +508,87 @@ class AnnotationApp(QWidget):
             # Load the selected point
             self._load_point(target_point_index)
     
+    def _highlight_fetched_text(self, item_data, point_data):
+        """
+        Indexes a fetched text of the current point, computes its highlight
+        spans (item-specific highlights take precedence over point keywords,
+        both over temporary keywords) and returns its rendered HTML.
+        """
+        item_id = item_data["id"]
+        text = item_data.get("text", "")
+        spans = self.highlight_cache.spans(
+            text,
+            [
+                (item_data.get("highlights", []), self.ITEM_HIGHLIGHT_COLOR),
+                (point_data.get("keywords", []), self.HIGHLIGHT_COLOR),
+            ],
+        )
+        self.fetched_items[item_id] = item_data
+        self.fetched_spans[item_id] = spans
+        self.fetched_temp_spans[item_id] = {
+            keyword: self.highlight_cache.spans(
+                text, [([keyword], self.HIGHLIGHT_COLOR)], exclude=spans
+            )
+            for keyword in self.temp_keywords
+        }
+        return self._render_fetched_text(item_id)
+
+    def _render_fetched_text(self, item_id):
+        """Renders a fetched text with its current highlight spans."""
+        spans = merge_highlight_spans(
+            self.fetched_spans[item_id], *self.fetched_temp_spans[item_id].values()
+        )
+        return self.highlight_cache.render_spans(
+            self.fetched_items[item_id].get("text", ""), spans
+        )
+
     @Slot(list)
     def _on_temp_keywords_changed(self, temp_keywords):
-        """Handle changes in temporary keyword selection from description."""
+        """
+        Handle changes in temporary keyword selection from description.
+
+        Only the spans of the keywords that were (de)selected are added to or
+        dropped from the fetched texts, and only texts whose highlights
+        changed are rendered again.
+        """
         if self.current_point_index is None or not self.ground_truth_data["points"]:
             return
-            
+
         point_data = self.ground_truth_data["points"][self.current_point_index]
-        
-        # Re-highlight all fetched texts with new temporary keywords
+
+        # Point keywords are always highlighted, the selection adds keywords on top
+        point_keywords = {kw.lower() for kw in point_data.get("keywords", [])}
+        selected = [kw for kw in temp_keywords if kw.lower() not in point_keywords]
+        added = [kw for kw in selected if kw not in self.temp_keywords]
+        removed = [kw for kw in self.temp_keywords if kw not in selected]
+        if not added and not removed:
+            return
+        self.temp_keywords = [
+            kw for kw in self.temp_keywords if kw not in removed
+        ] + added
+
         for item_widget in self.left_panel.get_all_items():
-            if hasattr(item_widget, 'item_id'):
-                # Find the corresponding item data
-                for item_data in point_data.get("fetched_texts", []):
-                    if item_data.get("id") == item_widget.item_id:
-                        text = item_data.get("text", "")
-                        item_specific_highlights = item_data.get("highlights", [])
-                        
-                        # Apply highlighting: item-specific first, then temp keywords
-                        temp_highlighted_text = text
-                        if item_specific_highlights:
-                            temp_highlighted_text = highlight_keywords(
-                                temp_highlighted_text,
-                                item_specific_highlights,
-                                self.ITEM_HIGHLIGHT_COLOR,
-                            )
-                        
-                        # Combine original point keywords with temporary keywords
-                        original_keywords = point_data.get("keywords", [])
-                        all_keywords = list(set(original_keywords + temp_keywords))
-                        if all_keywords:
-                            temp_highlighted_text = highlight_keywords(
-                                temp_highlighted_text, all_keywords, self.HIGHLIGHT_COLOR
-                            )
-                        
-                        formatted_text = format_md_text_to_html(temp_highlighted_text)
-                        item_widget.set_text(formatted_text)
-                        break
+            item_id = item_widget.item_id
+            item_data = self.fetched_items.get(item_id)
+            if item_data is None:
+                continue
+
+            temp_spans = self.fetched_temp_spans[item_id]
+            changed = False
+            for keyword in removed:
+                changed |= bool(temp_spans.pop(keyword, ()))
+            for keyword in added:
+                # A keyword whose exact matches all lie in the item or point
+                # highlights adds nothing rather than a fuzzy match elsewhere
+                temp_spans[keyword] = self.highlight_cache.spans(
+                    item_data.get("text", ""),
+                    [([keyword], self.HIGHLIGHT_COLOR)],
+                    exclude=self.fetched_spans[item_id],
+                )
+                changed |= bool(temp_spans[keyword])
+
+            if changed:
+                item_widget.set_text(self._render_fetched_text(item_id))
 
     @Slot(str)
     def perform_bm25_search(self, search_query=None):
@@ -403,10 +599,17 @@ class AnnotationApp(QWidget):
             logger.warning("No current point selected.")
             return
 
+        if self.bm25_searcher is None:
+            logger.warning("BM25 index is not ready yet.")
+            return
+
         point_data = self.ground_truth_data["points"][self.current_point_index]
 
-        # Clear previous results
+        # Clear previous results, pending live results are outdated now
         self.right_panel.clear()
+        self.bm25_results = None
+        self.search_view = None
+        self.live_search_generation += 1
 
         keywords = point_data.get("keywords", [])
         description = point_data.get("description", "")
@@ -423,32 +626,217 @@ class AnnotationApp(QWidget):
 
         logger.info(f"Performing BM25 search with query: {search_query}")
 
-        # Perform the search using the BM25 index
-        results = self.bm25_index.get_top_n(search_query, self.bm25_texts, n=20)
+        # Perform the search using the BM25 index, all matches are ranked for paging
+        # and near-duplicates are collapsed into their best match
+        ranking = self.bm25_searcher.rank(
+            search_query, exclude=self._used_doc_indices(point_data), collapse=True
+        )
 
-        logger.info(f"Found {len(results)} BM25 search results")
+        logger.info(f"Found {len(ranking)} BM25 search results")
+        self._show_search_ranking(ranking, search_query, keywords)
 
-        # Display results in the right panel
-        if not results:
-            # Show a message when no results are found
-            self.right_panel.add_message("No results found for this query.")
+    @Slot(str)
+    def perform_more_like_selected_search(self, search_query=""):
+        """
+        Searches for texts similar to the point's selected texts: the search
+        field query is expanded with the characteristic terms of those texts.
+        """
+        if self.current_point_index is None or not self.ground_truth_data["points"]:
+            logger.warning("No current point selected.")
+            return
+
+        if self.bm25_searcher is None:
+            logger.warning("BM25 index is not ready yet.")
+            return
+
+        point_data = self.ground_truth_data["points"][self.current_point_index]
+        self.right_panel.clear()
+        self.bm25_results = None
+        self.search_view = None
+        self.live_search_generation += 1
+
+        relevant = [
+            self.id_to_doc_index[item["id"]]
+            for item in point_data.get("selected_texts", [])
+            if item.get("id") in self.id_to_doc_index
+        ]
+        if not relevant:
+            self.right_panel.add_message("Select relevant texts on the left side first.")
             return
 
-        used_ids = [
-            item["id"]
+        weights = self.bm25_searcher.feedback_query(relevant, search_query)
+        logger.info(f"Performing BM25 search with expanded query: {weights}")
+        ranking = self.bm25_searcher.rank_weighted(
+            weights, exclude=self._used_doc_indices(point_data), collapse=True
+        )
+        logger.info(f"Found {len(ranking)} BM25 search results")
+
+        expansion = sorted(weights, key=weights.get, reverse=True)
+        self._show_search_ranking(
+            ranking,
+            search_query,
+            point_data.get("keywords", []),
+            message="More like selected: " + ", ".join(expansion[:10]),
+        )
+
+    def _used_doc_indices(self, point_data):
+        """Index positions of the point's fetched texts, left out of BM25 results."""
+        return [
+            self.id_to_doc_index[item["id"]]
             for item in point_data.get("fetched_texts", [])
-            if item.get("id") is not None
+            if item.get("id") in self.id_to_doc_index
         ]
 
-        # Add each result to the right panel
-        results_added = False
-        for result_text in results:
-            # get the id
-            actual_id = self.text_to_id_map.get(result_text)
+    def _show_search_ranking(self, ranking, search_query, keywords, message=None):
+        """
+        Shows the ranking of a search (fused with the embedding ranking if
+        hybrid search is on) below ``message``, or a message if nothing matched.
+        """
+        self.search_view = (ranking, search_query, keywords, message)
+        self._show_search_view()
 
-            # do not display bm25 search when already visible in left panel
-            if actual_id in used_ids:
-                continue
+    def _show_search_view(self):
+        """(Re)populates the right panel with the current search view."""
+        ranking, search_query, keywords, message = self.search_view
+        self.right_panel.clear()
+        self.bm25_results = None
+        if message:
+            self.right_panel.add_message(message)
+
+        score_kind = "bm25"
+        if self.dense_index is not None and self.right_panel.is_hybrid():
+            similarities = self._dense_similarities()
+            if similarities is not None:
+                # Only the matches of the query are reordered, the embedding
+                # ranking holds the same (collapsed) matches
+                ranking = reciprocal_rank_fusion(
+                    [ranking, similarity_ranking(similarities, ranking)]
+                )
+                score_kind = "rrf"
+
+        if not len(ranking):
+            # Show a message when no results are found
+            self.right_panel.add_message(
+                "No results found for this query, or results already on left side."
+            )
+            return
+
+        self._show_bm25_ranking(ranking, search_query, keywords, score_kind)
+
+    def _dense_similarities(self):
+        """
+        Returns the similarities of all texts to the point's embedding, the
+        point's own ``embedding`` if it has one and the centroid of its
+        selected texts otherwise, or None without a query vector. They do not
+        depend on the search query, so they are computed once per point and
+        per change of its selected texts.
+        """
+        point_data = self.ground_truth_data["points"][self.current_point_index]
+        query_vector = point_data.get("embedding")
+        selected = ()
+        if not query_vector:
+            selected = tuple(
+                self.id_to_doc_index[item["id"]]
+                for item in point_data.get("selected_texts", [])
+                if item.get("id") in self.id_to_doc_index
+            )
+        key = (self.current_point_index, selected)
+        if self.dense_similarities is not None and self.dense_similarities[0] == key:
+            return self.dense_similarities[1]
+
+        similarities = None
+        if not query_vector:
+            query_vector = self.dense_index.query_vector(selected)
+        if query_vector is not None:
+            try:
+                similarities = self.dense_index.similarities(query_vector)
+            except ValueError as e:
+                logger.warning(f"Embedding search failed: {e}")
+        self.dense_similarities = (key, similarities)
+        return similarities
+
+    @Slot(bool)
+    def _on_hybrid_toggled(self, checked):
+        """Shows the current search with or without the embedding ranking."""
+        if self.search_view is not None:
+            self._show_search_view()
+
+    @Slot(str)
+    def _on_live_search_requested(self, search_query):
+        """Searches the partially typed query in the live search thread."""
+        if self.live_search is None or self.current_point_index is None:
+            return
+        if not self.ground_truth_data["points"]:
+            return
+        point_data = self.ground_truth_data["points"][self.current_point_index]
+        self.live_search_generation += 1
+        if not search_query.strip():
+            # Back to the precomputed results of the point, if any
+            self.right_panel.clear()
+            self.bm25_results = None
+            self.search_view = None
+            self._show_precomputed_candidates(point_data)
+            return
+        self.live_search.submit(
+            self.live_search_generation, search_query, self._used_doc_indices(point_data)
+        )
+
+    @Slot(int, str, object)
+    def _on_live_search_results(self, generation, search_query, ranking):
+        """Shows live search results unless a newer search was started meanwhile."""
+        if generation != self.live_search_generation:
+            return
+        point_data = self.ground_truth_data["points"][self.current_point_index]
+        self._show_search_ranking(ranking, search_query, point_data.get("keywords", []))
+
+    def _show_bm25_ranking(self, ranking, search_query, keywords, score_kind="bm25"):
+        """Shows the first page of a ranking in the right panel."""
+        self.bm25_results = ranking
+        self.bm25_results_score_kind = score_kind
+        self.bm25_results_shown = 0
+        self.bm25_results_query = search_query
+        self.bm25_results_keywords = keywords
+        self._load_more_bm25_results()
+
+    @Slot()
+    def _load_more_bm25_results(self):
+        """Appends the next page of the current ranking to the right panel."""
+        if self.bm25_results is None:
+            return
+        results = self.bm25_results.page(self.bm25_results_shown, self.BM25_PAGE_SIZE)
+        self.bm25_results_shown += len(results)
+        self._display_bm25_results(
+            results, self.bm25_results_query, self.bm25_results_keywords
+        )
+        self.right_panel.set_more_available(
+            self.bm25_results_shown < len(self.bm25_results)
+        )
+
+    @Slot(QWidget)
+    def _expand_near_duplicates(self, item_widget):
+        """Shows the collapsed near-duplicates of a result right below it."""
+        if self.bm25_results is None:
+            return
+        doc_index = self.id_to_doc_index.get(item_widget.item_id)
+        self._display_bm25_results(
+            self.bm25_results.duplicates(doc_index),
+            self.bm25_results_query,
+            self.bm25_results_keywords,
+            position=self.right_panel.index_of(item_widget) + 1,
+            # Duplicates keep the score of the ranking they were collapsed in,
+            # which is not comparable to fused scores
+            show_scores=self.bm25_results_score_kind != "rrf",
+        )
+
+    def _display_bm25_results(
+        self, results, search_query, keywords, position=None, show_scores=True
+    ):
+        """
+        Adds highlighted BM25 results to the right panel, at the end or from
+        ``position`` on.
+        """
+        for offset, result in enumerate(results):
+            result_text = self.bm25_texts[result.doc_index]
 
             # Determine terms to highlight based on original logic
             # Use temporary keywords from description if available
@@ -463,19 +851,27 @@ class AnnotationApp(QWidget):
             else:
                 terms_to_highlight_in_bm25 = list(set(effective_keywords))
 
-            highlighted_text = highlight_keywords(
-                result_text, terms_to_highlight_in_bm25, self.HIGHLIGHT_COLOR
+            # Quoted phrases of the query are highlighted as a whole
+            terms_to_highlight_in_bm25 += [
+                phrase for phrase in re.findall(r'"([^"]+)"', search_query)
+                if phrase not in terms_to_highlight_in_bm25
+            ]
+
+            formatted_text = self.highlight_cache.render(
+                result_text, [(terms_to_highlight_in_bm25, self.HIGHLIGHT_COLOR)]
             )
-            formatted_text = format_md_text_to_html(highlighted_text)
             
             # Add the result to the right panel
-            self.right_panel.add_item(actual_id, formatted_text)
-            results_added = True
-
-        # If no widgets were added, search returned nothing
-        if not results_added:
-            self.right_panel.add_message(
-                "No results found for this query, or results already on left side."
+            duplicates = 0
+            if self.bm25_results is not None:
+                duplicates = self.bm25_results.num_duplicates(result.doc_index)
+            self.right_panel.add_item(
+                result.doc_id,
+                formatted_text,
+                score=result.score if show_scores else None,
+                score_kind=self.bm25_results_score_kind,
+                duplicates=duplicates,
+                position=None if position is None else position + offset,
             )
 
     @Slot(QWidget)
@@ -558,6 +954,9 @@ class AnnotationApp(QWidget):
 
         if len(point_data["fetched_texts"]) < initial_length:
             logger.info(f"Removed item ID {item_id_to_remove} from fetched_texts.")
+            self.fetched_items.pop(item_id_to_remove, None)
+            self.fetched_spans.pop(item_id_to_remove, None)
+            self.fetched_temp_spans.pop(item_id_to_remove, None)
 
             # Also remove from selected_texts if it was there
             selected_texts = point_data.get("selected_texts", [])
@@ -588,14 +987,13 @@ class AnnotationApp(QWidget):
             return  # Don't allow changes if evaluated
 
         # Check if the item is already in fetched_texts
-        fetched_texts = point_data.get("fetched_texts", [])
-        if any(item.get("id") == item_widget.item_id for item in fetched_texts):
+        if item_widget.item_id in self.fetched_items:
             logger.warning(f"Item ID {item_widget.item_id} already in fetched_texts.")
             return
 
-        # Get the text and item id from the widget
-        result_text = item_widget.get_text()
+        # The widget only holds the highlighted HTML, take the text from the corpus
         result_id = item_widget.item_id
+        result_text = self.bm25_texts[self.id_to_doc_index[result_id]]
 
         # Create a new item for fetched_texts
         new_item = {
@@ -611,11 +1009,7 @@ class AnnotationApp(QWidget):
         logger.info(f"Added BM25 result as new fetched text with ID: {result_id}")
 
         # Add to the left panel UI
-        keywords = point_data.get("keywords", [])
-        highlighted_text = highlight_keywords(
-            result_text, keywords, self.HIGHLIGHT_COLOR
-        )
-        formatted_text = format_md_text_to_html(highlighted_text)
+        formatted_text = self._highlight_fetched_text(new_item, point_data)
         self.left_panel.add_item(result_id, formatted_text, "bm25-appended")
 
         # Note: Saving happens on navigation or confirm
@@ -14,6 +14,7 @@ from typing import Any
 class ListItemWidget(QFrame):
     button_clicked_signal: Signal = Signal(QFrame)
     item_clicked_signal: Signal = Signal(QFrame)
+    expand_clicked_signal: Signal = Signal(QFrame)
 
     # Color mapping for different text sources. Used for the source label background.
     SOURCE_COLORS: dict[str, str] = {
@@ -32,10 +33,17 @@ class ListItemWidget(QFrame):
         "default": "#000000",
     }
 
-    def __init__(self, item_id: Any, text: str, source: str, button_text: str, metadata: dict[str, Any] | None = None, parent: QWidget | None = None) -> None:
+    # Tooltip and format of the search score per kind of score
+    SCORE_KINDS: dict[str, tuple[str, str]] = {
+        "bm25": ("BM25 score", "{:.2f}"),
+        "rrf": ("Hybrid score (reciprocal rank fusion of BM25 and embeddings)", "{:.4f}"),
+    }
+
+    def __init__(self, item_id: Any, text: str, source: str, button_text: str, metadata: dict[str, Any] | None = None, score: float | None = None, duplicates: int = 0, score_kind: str = "bm25", parent: QWidget | None = None) -> None:
         super().__init__(parent)
         self.item_id = item_id
         self.source = source
+        self.score = score
         self.original_text = text
 
         # Layout for the item (text label + button)
@@ -72,6 +80,17 @@ class ListItemWidget(QFrame):
             QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed
         )
 
+        # Search score (only for search results)
+        self.score_label = None
+        if score is not None:
+            tooltip, score_format = self.SCORE_KINDS[score_kind]
+            self.score_label = QLabel(score_format.format(score))
+            self.score_label.setToolTip(tooltip)
+            self.score_label.setStyleSheet("color: #AAAAAA; font-size: 8pt;")
+            self.score_label.setSizePolicy(
+                QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed
+            )
+
         # Label to display text
         self.label = QLabel(text)
         self.label.setTextFormat(Qt.TextFormat.RichText)
@@ -80,13 +99,27 @@ class ListItemWidget(QFrame):
             QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred
         )
 
+        # Expands the collapsed near-duplicates of a search result
+        self.expand_button = None
+        if duplicates:
+            self.expand_button = QPushButton(f"+{duplicates} similar")
+            self.expand_button.setToolTip("Show near-duplicate texts of this result")
+            self.expand_button.clicked.connect(self._emit_expand_clicked)
+            self.expand_button.setSizePolicy(
+                QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed
+            )
+
         # Button (Add or Remove)
         self.button = QPushButton(button_text)
         self.button.clicked.connect(self._emit_button_clicked)
         self.button.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed)
 
         item_layout.addWidget(self.source_label)
+        if self.score_label is not None:
+            item_layout.addWidget(self.score_label)
         item_layout.addWidget(self.label)
+        if self.expand_button is not None:
+            item_layout.addWidget(self.expand_button)
         item_layout.addWidget(self.button)
 
         self.setFrameShape(QFrame.Shape.StyledPanel)
@@ -99,6 +132,11 @@ class ListItemWidget(QFrame):
     def _emit_button_clicked(self) -> None:
         self.button_clicked_signal.emit(self)
 
+    def _emit_expand_clicked(self) -> None:
+        # Near-duplicates are only expanded once
+        self.expand_button.hide()
+        self.expand_clicked_signal.emit(self)
+
     def _emit_item_clicked(self) -> None:
         self.item_clicked_signal.emit(self)
 
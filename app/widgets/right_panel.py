@@ -7,10 +7,12 @@ from PySide6.QtWidgets import (
     QScrollArea,
     QLineEdit,
     QPushButton,
+    QCheckBox,
     QLabel,
     QFrame,
+    QProgressBar,
 )
-from PySide6.QtCore import Qt, Signal, Slot
+from PySide6.QtCore import Qt, QTimer, Signal, Slot
 from app.widgets.list_item_widget import ListItemWidget
 from app.utils.ui_helpers import clear_layout
 
@@ -21,16 +23,38 @@ class RightPanel(QWidget):
     
     # Signal emitted when search is requested
     search_requested = Signal(str)
+    # Signal emitted when typing in the search field pauses
+    live_search_requested = Signal(str)
+    # Signal emitted when a search for texts like the selected ones is requested
+    more_like_selected_requested = Signal(str)
     # Signal emitted when an item's add button is clicked
     item_add_clicked = Signal(QWidget)
+    # Signal emitted when the near-duplicates of an item should be shown
+    item_expand_clicked = Signal(QWidget)
+    # Signal emitted when the next page of results should be loaded
+    more_results_requested = Signal()
+    # Signal emitted when hybrid (BM25 + embedding) search is switched on or off
+    hybrid_toggled = Signal(bool)
+
+    # Distance in pixels from the bottom at which the next page is loaded
+    LOAD_MORE_THRESHOLD = 100
+    # Typing pause in milliseconds after which the live search runs
+    LIVE_SEARCH_DELAY_MS = 150
     
     def __init__(self, parent=None):
         super().__init__(parent)
         self.search_input = None
         self.search_button = None
+        self.more_like_button = None
+        self.hybrid_checkbox = None
+        self.status_label = None
+        self.progress_bar = None
         self.scroll_area = None
         self.list_widget = None
         self.list_layout = None
+        self.load_more_button = None
+        self._more_available = False
+        self._live_search_timer = None
         
         self._init_ui()
     
@@ -50,14 +74,46 @@ class RightPanel(QWidget):
         self.search_input.setMinimumWidth(200)
         self.search_input.setPlaceholderText("search field")
         self.search_button = QPushButton("Search")
+        self.more_like_button = QPushButton("More like selected")
+        self.more_like_button.setToolTip(
+            "Find texts similar to the selected ones and the search field query"
+        )
+        # Only shown if the input has embeddings
+        self.hybrid_checkbox = QCheckBox("Hybrid")
+        self.hybrid_checkbox.setToolTip(
+            "Fuse BM25 results with the texts closest to the point's embedding"
+        )
+        self.hybrid_checkbox.hide()
         
         # Connect signals
         self.search_button.clicked.connect(self._on_search_clicked)
+        self.more_like_button.clicked.connect(self._on_more_like_clicked)
         self.search_input.returnPressed.connect(self._on_search_clicked)
+        self.hybrid_checkbox.toggled.connect(self.hybrid_toggled)
+
+        # Live results once typing pauses, restarted with every keystroke
+        self._live_search_timer = QTimer(self)
+        self._live_search_timer.setSingleShot(True)
+        self._live_search_timer.setInterval(self.LIVE_SEARCH_DELAY_MS)
+        self._live_search_timer.timeout.connect(self._on_live_search_timeout)
+        self.search_input.textEdited.connect(self._live_search_timer.start)
         
         search_layout.addWidget(self.search_input)
         search_layout.addWidget(self.search_button)
+        search_layout.addWidget(self.more_like_button)
+        search_layout.addWidget(self.hybrid_checkbox)
         outer_layout.addLayout(search_layout)
+
+        # Index loading status, hidden once the index is ready
+        self.status_label = QLabel()
+        self.status_label.setStyleSheet("color: #888888;")
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setMaximumHeight(8)
+        outer_layout.addWidget(self.status_label)
+        outer_layout.addWidget(self.progress_bar)
+        self.status_label.hide()
+        self.progress_bar.hide()
         
         # Scroll Area for results
         self.scroll_area = QScrollArea()
@@ -73,18 +129,55 @@ class RightPanel(QWidget):
         
         self.scroll_area.setWidget(self.list_widget)
         outer_layout.addWidget(self.scroll_area)
+
+        # Further pages are loaded when scrolling to the bottom, the button covers
+        # result lists too short to scroll
+        self.scroll_area.verticalScrollBar().valueChanged.connect(self._on_scrolled)
+        self.load_more_button = QPushButton("Load more results")
+        self.load_more_button.clicked.connect(self._request_more_results)
+        self.load_more_button.hide()
+        outer_layout.addWidget(self.load_more_button)
         
         main_layout.addWidget(groupbox)
     
-    def add_item(self, item_id, text, source="bm25-appended"):
-        """Add a new search result item to the panel."""
-        item_widget = ListItemWidget(item_id, text, source, "Add")
+    def add_item(
+        self,
+        item_id,
+        text,
+        source="bm25-appended",
+        score=None,
+        duplicates=0,
+        position=None,
+        score_kind="bm25",
+    ):
+        """
+        Add a new search result item to the panel, at the end or at ``position``.
+        ``duplicates`` is the number of near-duplicates that can be expanded,
+        ``score_kind`` the kind of ``score`` (see ``ListItemWidget.SCORE_KINDS``).
+        """
+        item_widget = ListItemWidget(
+            item_id,
+            text,
+            source,
+            "Add",
+            score=score,
+            duplicates=duplicates,
+            score_kind=score_kind,
+        )
         
         # Connect signal
         item_widget.button_clicked_signal.connect(self._on_item_button_clicked)
+        item_widget.expand_clicked_signal.connect(self._on_item_expand_clicked)
         
-        self.list_layout.addWidget(item_widget)
+        if position is None:
+            self.list_layout.addWidget(item_widget)
+        else:
+            self.list_layout.insertWidget(position, item_widget)
         return item_widget
+
+    def index_of(self, item_widget):
+        """Position of an item in the result list."""
+        return self.list_layout.indexOf(item_widget)
     
     def add_message(self, message):
         """Add a message label to the panel."""
@@ -95,11 +188,59 @@ class RightPanel(QWidget):
     def clear(self):
         """Clear all items from the panel."""
         clear_layout(self.list_layout)
+        self.set_more_available(False)
+
+    def set_more_available(self, available):
+        """Set whether further result pages can be loaded."""
+        self._more_available = available
+        self.load_more_button.setVisible(available)
     
     def scroll_to_top(self):
         """Scroll the panel to the top."""
         self.scroll_area.verticalScrollBar().setValue(0)
     
+    def set_search_enabled(self, enabled):
+        """Enable or disable the search controls."""
+        self.search_input.setEnabled(enabled)
+        self.search_button.setEnabled(enabled)
+        self.more_like_button.setEnabled(enabled)
+        self.hybrid_checkbox.setEnabled(enabled)
+
+    def set_hybrid_available(self, available):
+        """Show the hybrid search toggle, switched off, if embeddings are available."""
+        self.hybrid_checkbox.setVisible(available)
+        self.hybrid_checkbox.setChecked(False)
+
+    def is_hybrid(self):
+        """Whether BM25 results are fused with embedding similarity."""
+        return self.hybrid_checkbox.isChecked()
+
+    def set_index_progress(self, stage, done, total, eta):
+        """
+        Show the progress of the index build. ``total`` is 0 for stages of unknown
+        length, ``eta`` the estimated remaining seconds or -1 if unknown.
+        """
+        message = f"{stage}..."
+        if total:
+            message = f"{stage}: {done:,} / {total:,}"
+            if eta >= 0:
+                minutes, seconds = divmod(int(eta), 60)
+                message += f" (about {minutes}:{seconds:02d} remaining)"
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(done)
+        else:
+            # Busy indicator
+            self.progress_bar.setRange(0, 0)
+        self.status_label.setText(message)
+        self.status_label.show()
+        self.progress_bar.show()
+
+    def set_index_status(self, message=None):
+        """Show a status message instead of the progress bar, or hide both if None."""
+        self.progress_bar.hide()
+        self.status_label.setText(message or "")
+        self.status_label.setVisible(bool(message))
+
     def get_search_text(self):
         """Get the current search text."""
         return self.search_input.text()
@@ -111,8 +252,36 @@ class RightPanel(QWidget):
     @Slot()
     def _on_search_clicked(self):
         """Handle search button click or Enter key press."""
+        self._live_search_timer.stop()
         self.search_requested.emit(self.search_input.text())
+
+    @Slot()
+    def _on_more_like_clicked(self):
+        self._live_search_timer.stop()
+        self.more_like_selected_requested.emit(self.search_input.text())
+
+    @Slot()
+    def _on_live_search_timeout(self):
+        self.live_search_requested.emit(self.search_input.text())
     
+    @Slot(int)
+    def _on_scrolled(self, value):
+        """Request the next page once the results are scrolled near the bottom."""
+        scroll_bar = self.scroll_area.verticalScrollBar()
+        if value >= scroll_bar.maximum() - self.LOAD_MORE_THRESHOLD:
+            self._request_more_results()
+
+    @Slot()
+    def _request_more_results(self):
+        # Only one request per page, until the owner reports more results again
+        if self._more_available:
+            self.set_more_available(False)
+            self.more_results_requested.emit()
+
+    @Slot(QWidget)
+    def _on_item_expand_clicked(self, item_widget):
+        self.item_expand_clicked.emit(item_widget)
+
     @Slot(QWidget)
     def _on_item_button_clicked(self, item_widget):
         """Handle item button click."""
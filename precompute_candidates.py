@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+"""
+Precompute BM25 candidates - Entry point script
+Writes the ranked BM25 candidates of every point into a sidecar file next to
+the annotation file, which the annotation tool shows when a point is opened.
+"""
+
+from app.precompute import main
+
+if __name__ == "__main__":
+    main()